@@ -5,23 +5,39 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QComboBox, QSpinBox, QDoubleSpinBox, QFrame, QDialog, QDialogButtonBox,
                              QGroupBox, QRadioButton, QLineEdit, QFormLayout,
                              QMessageBox, QFileDialog, QFontDialog, QColorDialog,
-                             QTabWidget, QCheckBox, QSlider, QTextEdit, QProgressBar)  # 添加缺失的类
-from PyQt5.QtCore import Qt, QPoint, QRect, QTimer, QSize, QThread, pyqtSignal, QMimeData
-from PyQt5.QtGui import QPainter, QPen, QColor, QPixmap, QIcon, QFont, QTransform, QBrush, QImage
-from PyQt5.QtGui import QClipboard, QPainterPath  # 添加剪贴板支持和绘图路径
-from PyQt5.QtGui import QFontDatabase  # 添加字体数据库支持
+                             QTabWidget, QCheckBox, QSlider, QTextEdit, QProgressBar,
+                             QInputDialog)  # 添加缺失的类
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRect, QRectF, QTimer, QSize, QThread, pyqtSignal, QMimeData
+from PyQt5.QtGui import QPainter, QPen, QColor, QPixmap, QIcon, QFont, QTransform, QBrush, QImage, QPolygon, QPolygonF, QRegion
+from PyQt5.QtGui import QClipboard  # 添加剪贴板支持
+from PyQt5.QtGui import QFontDatabase, QFontMetrics  # 添加字体数据库支持
 from PyQt5.QtPrintSupport import QPrinter, QPrintDialog, QPrintPreviewDialog  # 添加打印支持
 import base64
-import random
 import datetime
 import requests
 import json
 import time
+import math
 import configparser
 import os
+import numpy as np
 
 # 导入多模型配置
 from paint_models_config import AI_MODEL_CONFIGS, get_model_config, get_available_models
+# 导入分块画布模型
+from paint_canvas_model import TiledImage
+from paint_history import UndoHistory, DEFAULT_HISTORY_BUDGET
+from paint_selection import SelectionMask
+from paint_resample import resized_image, fitted_image
+from paint_image_ops import (invert_image, color_bgra,
+                             tiled_match_mask, flood_fill_region, mask_bounds,
+                             circle_mask, replace_color_masked, disc_points, erase_dots,
+                             catmull_rom_polyline, catmull_rom_curve, polyline_path,
+                             simplify_polyline, apply_alpha_mask,
+                             fill_tiled_mask, inverted_image, flipped_image, rotated_image,
+                             stretched_image, skewed_image, right_angle_orientation, orient_tiled,
+                             transformed_image, flip_transform, stretch_transform, skew_transform,
+                             flood_fill_tiled, filled_image, polygon_cropped)
 
 class ColorDisplayWidget(QWidget):
     """自定义颜色显示组件，实现45度角斜向叠放效果"""
@@ -1201,14 +1217,145 @@ class AIImageWorker(QThread):
         return image_data_list
 
 
+class OperationCancelled(Exception):
+    """后台画布操作被取消"""
+
+
+class CanvasOperationWorker(QThread):
+    """画布操作工作线程：在文档快照的私有副本上执行耗时运算，完成后把结果快照交回界面线程"""
+    progress = pyqtSignal(int)
+    operation_finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+    
+    def __init__(self, compute, snapshot):
+        super().__init__()
+        self.compute = compute
+        self.snapshot = snapshot
+        self._is_running = True
+        self._percent = -1
+    
+    def cancel(self):
+        """请求取消，运算在下一次报告进度时中止"""
+        self._is_running = False
+    
+    def is_cancelled(self):
+        return not self._is_running
+    
+    def report(self, fraction):
+        """运算报告进度（0~1）；已取消时抛出OperationCancelled中止运算"""
+        if not self._is_running:
+            raise OperationCancelled()
+        percent = int(fraction * 100)
+        if percent != self._percent:
+            self._percent = percent
+            self.progress.emit(percent)
+    
+    def run(self):
+        """在工作线程中执行运算（只使用QImage和分块图像，不触及界面对象）"""
+        try:
+            tiled = TiledImage(0, 0)
+            tiled.restore(self.snapshot)
+            value = self.compute(tiled, self.report)
+            if self._is_running:
+                self.operation_finished.emit((tiled.snapshot(), value))
+        except OperationCancelled:
+            pass
+        except Exception as e:
+            if self._is_running:
+                self.error.emit(f"发生错误: {str(e)}")
+
+
+class TransformPreviewWorker(QThread):
+    """变换预览工作线程：对缩小图执行一次变换，结果超出预览区时缩小到预览区大小"""
+    preview_ready = pyqtSignal(QImage)
+    error = pyqtSignal(str)
+    
+    def __init__(self, image, background, operation, size):
+        super().__init__()
+        self.image = image
+        self.background = background
+        self.operation = operation
+        self.size = size
+    
+    def run(self):
+        """在工作线程中执行变换（只使用QImage，不触及界面对象）"""
+        try:
+            result = self.operation(self.image, self.background)
+            if result.width() > self.size.width() or result.height() > self.size.height():
+                result = result.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.preview_ready.emit(result)
+        except Exception as e:
+            self.error.emit(f"无法预览: {str(e)}")
+
+
+class TransformPreview(QLabel):
+    """变换对话框的实时预览
+
+    参数变化时调用 request()，停止变化 delay_ms 毫秒后才在工作线程中对缩小图执行变换；
+    上一次预览还在计算时只记下最新参数，算完后再算最新的一次。
+    """
+    
+    def __init__(self, proxy, background, parent=None):
+        super().__init__(parent)
+        self.proxy = proxy  # 画布或选区的缩小图
+        self.background = background  # 变换后空出部分的填充色
+        self.delay_ms = 120  # 防抖间隔
+        self._operation = None
+        self._worker = None
+        self._busy = False  # 工作线程正在计算，在它的finished槽中才清除
+        self._pending = False  # 计算期间参数又变化过
+        self.setFixedSize(200, 200)
+        self.setAlignment(Qt.AlignCenter)
+        self.setFrameShape(QFrame.StyledPanel)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._start)
+    
+    def request(self, operation):
+        """预览 operation(image, background) -> QImage 的效果"""
+        self._operation = operation
+        self._timer.start(self.delay_ms)
+    
+    def _start(self):
+        if self._busy:
+            self._pending = True
+            return
+        self._busy = True
+        self._worker = TransformPreviewWorker(self.proxy, self.background, self._operation, self.size())
+        self._worker.preview_ready.connect(self._show)
+        self._worker.error.connect(self.setText)
+        self._worker.finished.connect(self._worker_finished)
+        self._worker.start()
+    
+    def _show(self, image):
+        self.setPixmap(QPixmap.fromImage(image))
+    
+    def _worker_finished(self):
+        self._worker.deleteLater()
+        self._worker = None
+        self._busy = False
+        if self._pending:
+            self._pending = False
+            self._start()
+    
+    def stop(self):
+        """停止预览并等待工作线程结束（对话框关闭时调用）"""
+        self._timer.stop()
+        self._pending = False
+        if self._worker is not None:
+            self._worker.wait()
+
+
 class StretchSkewDialog(QDialog):
     """拉伸和扭曲对话框"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, preview=None):
         super().__init__(parent)
         self.setWindowTitle("拉伸和扭曲")
-        self.setFixedSize(250, 300)
+        self.setFixedSize(480 if preview else 250, 300)
         
-        layout = QVBoxLayout(self)
+        outer_layout = QHBoxLayout(self)
+        layout = QVBoxLayout()
+        outer_layout.addLayout(layout)
         
         # 拉伸部分
         stretch_group = QGroupBox("拉伸")
@@ -1252,16 +1399,56 @@ class StretchSkewDialog(QDialog):
         button_box.rejected.connect(self.reject)
         
         layout.addWidget(button_box)
+        
+        # 预览（preview 为画布或选区的缩小图和填充色）
+        self.preview = None
+        if preview:
+            self.preview = TransformPreview(*preview)
+            outer_layout.addWidget(_preview_group(self.preview))
+            for spin in (self.horizontal_stretch_spin, self.vertical_stretch_spin,
+                         self.horizontal_skew_spin, self.vertical_skew_spin):
+                spin.valueChanged.connect(self.update_preview)
+            self.update_preview()
+    
+    def update_preview(self):
+        """按当前参数刷新预览"""
+        horizontal_stretch = self.horizontal_stretch_spin.value()
+        vertical_stretch = self.vertical_stretch_spin.value()
+        horizontal_skew = self.horizontal_skew_spin.value()
+        vertical_skew = self.vertical_skew_spin.value()
+        
+        def operation(image, background):
+            image = stretched_image(image, horizontal_stretch, vertical_stretch)
+            if horizontal_skew != 0 or vertical_skew != 0:
+                image = skewed_image(image, horizontal_skew, vertical_skew, background)
+            return image
+        
+        self.preview.request(operation)
+    
+    def done(self, result):
+        if self.preview is not None:
+            self.preview.stop()
+        super().done(result)
+
+
+def _preview_group(preview):
+    """把预览控件放进“预览”分组框"""
+    group = QGroupBox("预览")
+    group_layout = QVBoxLayout(group)
+    group_layout.addWidget(preview)
+    return group
 
 
 class FlipRotateDialog(QDialog):
     """翻转和旋转对话框"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, preview=None):
         super().__init__(parent)
         self.setWindowTitle("翻转和旋转")
-        self.setFixedSize(300, 300)
+        self.setFixedSize(530 if preview else 300, 300)
         
-        layout = QVBoxLayout(self)
+        outer_layout = QHBoxLayout(self)
+        layout = QVBoxLayout()
+        outer_layout.addLayout(layout)
         
         # 选项组
         options_group = QGroupBox("翻转或旋转")
@@ -1299,6 +1486,30 @@ class FlipRotateDialog(QDialog):
         button_box.rejected.connect(self.reject)
         
         layout.addWidget(button_box)
+        
+        # 预览（preview 为画布或选区的缩小图和填充色）
+        self.preview = None
+        if preview:
+            self.preview = TransformPreview(*preview)
+            outer_layout.addWidget(_preview_group(self.preview))
+            for radio in (self.flip_horizontal_radio, self.flip_vertical_radio, self.rotate_radio,
+                          self.rotate_90_radio, self.rotate_180_radio, self.rotate_270_radio):
+                radio.toggled.connect(self.update_preview)
+            self.update_preview()
+    
+    def update_preview(self):
+        """按当前选择刷新预览"""
+        selection = self.get_selection()
+        if selection in ("horizontal", "vertical"):
+            self.preview.request(lambda image, background: flipped_image(image, selection))
+        else:
+            angle = int(selection.split("_")[1])
+            self.preview.request(lambda image, background: rotated_image(image, angle, background))
+    
+    def done(self, result):
+        if self.preview is not None:
+            self.preview.stop()
+        super().done(result)
     
     def get_selection(self):
         """获取用户选择"""
@@ -1747,12 +1958,16 @@ class TextToolDialog(QDialog):
 
 class PaintCanvas(QWidget):
     """画布组件"""
+    operation_started = pyqtSignal(str)  # 后台操作开始（操作名称）
+    operation_progress = pyqtSignal(int)  # 后台操作进度（百分比）
+    operation_stopped = pyqtSignal(str)  # 后台操作结束（状态栏提示）
+    frame_stats_updated = pyqtSignal(dict)  # 帧统计（report_frame_stats 打开时每秒最多一次）
+    
     def __init__(self):
         super().__init__()
         self.setFixedSize(720, 520)
         self.setStyleSheet("background-color: white;")
-        self.image = QPixmap(self.size())
-        self.image.fill(Qt.white)
+        self.image = TiledImage(self.width(), self.height(), Qt.white)  # 分块存储的文档图像
         
         self.drawing = False
         self.last_point = QPoint()
@@ -1774,25 +1989,60 @@ class PaintCanvas(QWidget):
         self.text_font = QFont("Fixesys", 12)
         self.is_text_mode = False
         
+        # 重绘调度：收集脏区域和状态变化，每帧最多真正重绘一次
+        self._repaint_region = QRegion()  # 待重绘区域（widget坐标）
+        self._repaint_all = False  # 是否需要重绘整个画布
+        self._zoom_status_dirty = False  # 缩放信息是否需要推送到状态栏
+        self._in_frame = False  # 是否正在处理一帧
+        self._frame_due = 0.0  # 本帧预定的刷新时间
+        self._last_frame_time = 0.0  # 上一帧实际刷新的时间
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.setTimerType(Qt.PreciseTimer)
+        self._frame_timer.timeout.connect(self._flush_frame)
+        # frames: 实际刷新的帧数; coalesced: 合并到已排定帧中的请求数; dropped: 因刷新迟到而错过的帧数
+        self.frame_stats = {"frames": 0, "coalesced": 0, "dropped": 0}
+        self.report_frame_stats = False  # 是否定期发出 frame_stats_updated
+        self._stats_reported = 0.0  # 上次发出帧统计的时间
+        
+        # 铅笔/刷子的输入合并：鼠标移动只记录点，每帧把队列中的点画成一条折线
+        self._stroke_queue = []  # 尚未绘制的点（图像坐标）
+        self._stroke_smooth_pos = None  # 平滑滤波的当前位置
+        self.stroke_smoothing = 0.0  # 平滑强度（0为不平滑，越接近1越平滑）
+        
         # 喷枪定时器
         self.airbrush_timer = QTimer()
         self.airbrush_timer.timeout.connect(self.spray_paint)
+        self.airbrush_interval = 50  # 定时器间隔（毫秒）
+        self.airbrush_flow = 300  # 喷洒速度（每秒点数），与定时器间隔无关
         self.current_spray_pos = QPoint()
+        self.spray_color = self.pen_color  # 本次喷洒使用的颜色
+        self._spray_time = 0.0  # 上次喷洒的时间
+        self._spray_carry = 0.0  # 上次喷洒不足一个点的余量
+        self._spray_rng = np.random.default_rng()
         
         # 选区相关
         self.selection_rect = QRect()
         self.selection_active = False
         self.selection_dragging = False
-        self.selection_content = None  # 选区内容的图像副本
+        self.selection_content = None  # 选区内容的图像副本（取出时的原始像素）
+        self.selection_transform = QTransform()  # 选区内容的累计几何变换，提交时才按它重采样
+        self.selection_mask = None  # 矩形选区掩码（SelectionMask.from_rect，位于选区的原始位置）
         self.selection_transform_mode = None  # "move", "resize", "rotate"
         self.selection_start_pos = QPoint()  # 选区操作起始位置
         
         # 任意形状选区相关
         self.crop_points = []  # 任意形状选区的顶点
+        self._crop_settled = 0  # crop_points中已简化定稿的顶点数（最后一个定稿顶点之后的部分还会被简化）
+        self.crop_simplify_chunk = 64  # 未定稿的顶点达到此数量时做一次简化
         self.crop_drawing = False  # 是否正在绘制选区
         self.crop_selection_active = False  # 任意形状选区是否激活
-        self.crop_selection_content = None  # 任意形状选区内容的图像副本
-        self.crop_selection_mask = None  # 任意形状选区掩码
+        self.crop_selection_content = None  # 任意形状选区内容的图像副本（取出时的原始像素）
+        self.crop_selection_transform = QTransform()  # 任意形状选区内容和掩码的累计几何变换
+        self._preview_proxy = None  # (缓存键, (缩小图, 填充色))，见 preview_proxy()
+        self.crop_selection_mask = None  # 任意形状选区掩码（SelectionMask，位于选区的原始位置）
+        self._crop_combine = None  # 正在绘制的选区与原选区的组合方式："add"、"subtract"或None
+        self._crop_combine_base = None  # 参与组合的原选区掩码
         self.crop_selection_rect = QRect()  # 任意形状选区的边界矩形
         self.crop_selection_offset = QPoint(0, 0)  # 选区内容相对于原始位置的偏移
         self.crop_selection_original_points = []  # 选区的原始顶点（用于移动时更新）
@@ -1800,55 +2050,62 @@ class PaintCanvas(QWidget):
         
         # 多边形绘制相关
         self.polygon_points = []  # 多边形顶点
+        self._polygon_cache = {}  # 预览名称 -> (顶点列表, QPolygon)，顶点列表只追加时增量扩展
         self.polygon_drawing = False  # 多边形绘制状态
         self.polygon_preview = None  # 多边形预览图像
         self.polygon_fill_mode = "outline"  # 多边形填充模式: "outline"(仅轮廓), "filled"(轮廓+填充), "fill_only"(仅填充)
         self._last_polygon_click_time = 0  # 用于检测双击
         self._last_mouse_pos = QPoint()  # 记录鼠标位置用于预览
+        self._last_shape_rect = QRect()  # 上一次形状预览覆盖的区域（用于局部重绘）
+        self._shape_preview_end = None  # 形状预览的终点（预览绘制在覆盖层上）
         
         # 曲线绘制相关
         self.curve_points = []  # 曲线控制点
         self.curve_drawing = False  # 曲线绘制状态
         self._last_curve_click_time = 0  # 用于检测双击
         self.curve_button = None  # 记录使用的鼠标按钮（左键或右键）
+        self._curve_path_cache = None  # (控制点坐标, 曲线路径)，控制点变化时重新计算
         
         # 形状填充模式
         self.shape_fill_mode = "outline"  # "outline"(仅边框), "filled"(边框+填充), "fill_only"(仅填充)
         
+        # 填充工具设置
+        self.fill_mode = "flood"  # "flood"(填充连通区域), "replace"(替换全图中匹配的颜色)
+        self.fill_tolerance = 0  # 颜色容差（每个通道允许的最大差值，0-255）
+        self.fill_connectivity = 4  # 连通方式：4（上下左右）或8（含对角）
+        self.wand_tolerance = 32  # 魔棒颜色容差
+        self.wand_contiguous = True  # 魔棒是否只选择与点击处相连的区域
+        
         # 画布调整大小相关
         self.resizing_mode = None  # "right", "bottom", "corner"
         self.resizing_start_pos = QPoint()
         self.original_size = QSize()
         self.resize_handle_size = 8  # 控制点大小
-        self.original_image = None  # 原始图像副本，用于调整大小
+        self.original_image = None  # 调整大小前的原始图像，用于调整大小
         
         # 缩放（放大镜工具，仅影响显示，不改变画布内容）
         self.zoom_factor = 1.0       # 当前缩放倍率
         self.zoom_levels = [0.2, 0.25, 1/3, 0.5, 1.0, 2.0, 3.0]  # 可用档位
         self.zoom_index = 4          # 默认1.0在第4位
 
+        # 后台操作：大幅文档的耗时运算在工作线程中执行，期间锁定画布输入
+        self.operation_worker = None  # 正在执行的CanvasOperationWorker
+        self._operation_queue = []  # 等待执行的(名称, 运算, 收尾)
+        self._operation_error = None  # 正在执行的操作报告的错误
+        self.background_pixels = 2 * 1024 * 1024  # 文档像素数达到此值时才转入后台执行
+
         # 撤销/重做系统
-        self.undo_stack = []  # 撤销栈，存储QPixmap的深拷贝
-        self.redo_stack = []  # 重做栈
-        self.max_history = 5  # 最大历史记录数
+        # 每步只保存变化图块的压缩差异，总占用受字节预算限制
+        self.history = UndoHistory(DEFAULT_HISTORY_BUDGET)
+        self.history.reset(self.image)
         
         # 画布内容变化跟踪
         self.content_modified = False
-        self.original_content_hash = self._calculate_image_hash()
-        
-    def _calculate_image_hash(self):
-        """计算当前图像的哈希值用于检测变化"""
-        try:
-            # 将QPixmap转换为QImage以便获取像素数据
-            image = self.image.toImage()
-            # 获取图像数据的字节表示
-            bits = image.bits()
-            bits.setsize(image.byteCount())
-            # 计算哈希值
-            import hashlib
-            return hashlib.md5(bits.tobytes()).hexdigest()
-        except:
-            return ""
+        # 记录保存时的文档对象、修改计数和各图块摘要，修改计数未变化时无需比较内容
+        self._saved_image = self.image
+        self._saved_revision = self.image.revision
+        self._saved_size = self.image.size()
+        self._saved_digests = self.image.tile_digests()
     
     # ── 缩放辅助 ──────────────────────────────────────────────────
     def _apply_zoom(self):
@@ -1856,7 +2113,7 @@ class PaintCanvas(QWidget):
         w = int(self.image.width()  * self.zoom_factor)
         h = int(self.image.height() * self.zoom_factor)
         self.setFixedSize(w, h)
-        self.update()
+        self.request_repaint()
 
     def zoom_in(self, center=None):
         """放大一档（最大3.0倍），center 为图像坐标点"""
@@ -1882,6 +2139,11 @@ class PaintCanvas(QWidget):
         self._update_zoom_status()
 
     def _update_zoom_status(self):
+        """请求在下一帧向父窗口状态栏推送缩放信息"""
+        self._zoom_status_dirty = True
+        self._schedule_frame()
+
+    def _show_zoom_status(self):
         """向父窗口状态栏推送缩放信息"""
         try:
             pct = int(round(self.zoom_factor * 100))
@@ -1897,56 +2159,156 @@ class PaintCanvas(QWidget):
         y = int(pos.y() / self.zoom_factor)
         return QPoint(x, y)
 
+    def _padded_rect(self, rect, pad):
+        """把图像坐标矩形向四周外扩pad像素（用于笔宽、抗锯齿边缘）"""
+        pad = int(pad) + 2
+        return QRect(rect).normalized().adjusted(-pad, -pad, pad, pad)
+
+    def _segment_rect(self, p1, p2, width):
+        """线段p1-p2按笔宽外扩后的外接矩形"""
+        return self._padded_rect(QRect(p1, p2), width / 2)
+
+    def _image_rect_to_widget(self, rect):
+        """把图像坐标矩形映射为 widget 坐标矩形（向外取整）"""
+        if self.zoom_factor == 1.0:
+            return QRect(rect)
+        scaled = QTransform.fromScale(self.zoom_factor, self.zoom_factor).mapRect(QRectF(rect))
+        return scaled.toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def _widget_rect_to_image(self, rect):
+        """把 widget 坐标矩形映射为图像坐标矩形（向外取整）"""
+        if self.zoom_factor == 1.0:
+            return QRect(rect)
+        scale = 1.0 / self.zoom_factor
+        scaled = QTransform.fromScale(scale, scale).mapRect(QRectF(rect))
+        return scaled.toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def _update_image_rect(self, rect):
+        """只重绘图像坐标rect覆盖的区域"""
+        if not rect.isEmpty():
+            self.request_repaint(self._image_rect_to_widget(rect))
+
+    def _points_rect(self, points, pad=0):
+        """多个点的外接矩形，按pad外扩"""
+        xs = [p.x() for p in points]
+        ys = [p.y() for p in points]
+        return self._padded_rect(QRect(QPoint(min(xs), min(ys)), QPoint(max(xs), max(ys))), pad)
+
+    def _text_rect(self, font, baseline_pos, text):
+        """以baseline_pos为基线起点绘制text时覆盖的矩形"""
+        metrics = QFontMetrics(font)
+        return self._padded_rect(metrics.boundingRect(text).translated(baseline_pos), metrics.height() // 2)
+
     # ── 撤销/重做 ────────────────────────────────────────────────
     def save_state(self):
-        """在操作执行前调用，将当前画布状态推入撤销栈"""
-        # 创建当前图像的深拷贝（操作前的快照）
-        image_copy = QPixmap(self.image)
-        
-        # 添加到撤销栈
-        self.undo_stack.append(image_copy)
-        
-        # 限制历史记录数量
-        if len(self.undo_stack) > self.max_history:
-            self.undo_stack.pop(0)
-        
-        # 每次新操作前清空重做栈（新操作会使重做历史失效）
-        self.redo_stack.clear()
+        """在操作执行前调用，把上一步操作的变化记入撤销栈"""
+        self.history.save_state(self.image)
     
     def undo(self):
         """撤销操作"""
-        if not self.undo_stack:
+        if self.operation_worker is not None:
+            return False
+        self.flush_stroke()
+        if not self.history.undo(self.image):
             return False
         
-        # 将当前状态保存到重做栈
-        current_image = QPixmap(self.image)
-        self.redo_stack.append(current_image)
-        
-        # 从撤销栈恢复上一个状态
-        prev_image = self.undo_stack.pop()
-        self.image = QPixmap(prev_image)
-        
-        self.update()
+        self._apply_zoom()
         self.mark_content_modified()
         return True
     
     def redo(self):
         """重做操作"""
-        if not self.redo_stack:
+        if self.operation_worker is not None:
+            return False
+        self.flush_stroke()
+        if not self.history.redo(self.image):
             return False
         
-        # 将当前状态保存到撤销栈
-        current_image = QPixmap(self.image)
-        self.undo_stack.append(current_image)
-        
-        # 从重做栈恢复下一个状态
-        next_image = self.redo_stack.pop()
-        self.image = QPixmap(next_image)
-        
-        self.update()
+        self._apply_zoom()
         self.mark_content_modified()
         return True
 
+    # ── 后台操作 ──────────────────────────────────────────────────
+    def run_operation(self, title, compute, finish):
+        """对整幅文档执行一次运算
+
+        compute(tiled, progress) 就地修改分块图像并返回一个值；progress 为None时不报告进度，
+        否则以0~1的比例调用它，操作被取消时它抛出OperationCancelled。finish(值) 在界面线程中
+        收尾（重绘、标记修改）。小文档直接在界面线程中执行；大文档在工作线程中对文档快照的
+        副本运算，完成后把结果与撤销记录一起写回，取消则文档保持不变。已有操作在执行时排队，
+        前一个写回后再开始。
+        """
+        if self.operation_worker is not None:
+            self._operation_queue.append((title, compute, finish))
+            return
+        if self.image.width() * self.image.height() < self.background_pixels:
+            size = self.image.size()
+            self._finish_operation(size, finish, compute(self.image, None))
+            return
+        
+        worker = CanvasOperationWorker(compute, self.image.snapshot())
+        worker.progress.connect(self.operation_progress)
+        worker.operation_finished.connect(lambda result: self._apply_operation(worker, finish, result))
+        worker.error.connect(self._operation_failed)
+        worker.finished.connect(lambda: self._operation_stopped(worker, title))
+        self.operation_worker = worker
+        self._operation_error = None
+        self.operation_started.emit(title)
+        worker.start()
+    
+    def cancel_operation(self):
+        """取消正在执行和排队的后台操作"""
+        self._operation_queue = []
+        if self.operation_worker is not None:
+            self.operation_worker.cancel()
+    
+    def _apply_operation(self, worker, finish, result):
+        """把工作线程的结果写回文档：先记下之前的变化，使这次操作单独成为一步撤销"""
+        if worker is not self.operation_worker or worker.is_cancelled():
+            return
+        snapshot, value = result
+        size = self.image.size()
+        self.save_state()
+        self.image.restore(snapshot)
+        self._finish_operation(size, finish, value)
+    
+    def _finish_operation(self, size, finish, value):
+        if self.image.size() != size:
+            # 更新画布组件尺寸以匹配新图像大小（保持当前缩放）
+            self._apply_zoom()
+        finish(value)
+    
+    def _operation_failed(self, message):
+        self._operation_error = message
+    
+    def _operation_stopped(self, worker, title):
+        """工作线程结束：解除输入锁定，报告结果并开始下一个排队的操作"""
+        if worker is not self.operation_worker:
+            return
+        self.operation_worker = None
+        worker.deleteLater()
+        if self._operation_error is not None:
+            message = self._operation_error
+            self._operation_queue = []
+        elif worker.is_cancelled():
+            message = f"已取消{title}"
+        else:
+            message = f"{title}完成"
+        self.operation_stopped.emit(message)
+        if self._operation_queue:
+            # 排队的操作可能在界面线程中直接执行，先记下之前的变化，使它单独成为一步撤销
+            self.save_state()
+            self.run_operation(*self._operation_queue.pop(0))
+    
+    def _content_changed(self, value=None):
+        """整幅文档运算的收尾：重绘并标记修改"""
+        self.request_repaint()
+        self.mark_content_modified()
+    
+    def clear_history(self):
+        """清空撤销/重做历史（新建或打开文件后调用）"""
+        self.history.reset(self.image)
+
     def mark_content_modified(self):
         """标记画布内容为已修改"""
         self.content_modified = True
@@ -1954,57 +2316,39 @@ class PaintCanvas(QWidget):
     def is_content_modified(self):
         """检查画布内容是否已修改"""
         if not self.content_modified:
-            # 如果还没有标记为修改，检查当前图像哈希值是否与原始哈希值不同
-            current_hash = self._calculate_image_hash()
-            if current_hash != self.original_content_hash:
+            if self.image is self._saved_image and self.image.revision == self._saved_revision:
+                return False
+            # 如果还没有标记为修改，与保存时的图块摘要比较（只重新计算被修改过的图块）
+            if self.image.size() != self._saved_size:
                 self.content_modified = True
+            else:
+                digests = self.image.tile_digests(self._saved_digests)
+                self.content_modified = any(digest[1] != self._saved_digests[key][1]
+                                            for key, digest in digests.items())
         return self.content_modified
     
     def reset_content_modified_flag(self):
         """重置内容修改标志（通常在保存后调用）"""
         self.content_modified = False
-        self.original_content_hash = self._calculate_image_hash()
+        # 记录保存时的文档对象、修改计数和各图块摘要，未变化时无需比较内容
+        self._saved_image = self.image
+        self._saved_revision = self.image.revision
+        self._saved_size = self.image.size()
+        self._saved_digests = self.image.tile_digests()
     
     def perform_crop_operation(self):
         """执行任意形状裁剪操作"""
         if len(self.crop_points) >= 3:
-            # 创建裁剪后的新图像
-            image = self.image.toImage()
-            
-            # 计算多边形的边界矩形
-            min_x = min(point.x() for point in self.crop_points)
-            max_x = max(point.x() for point in self.crop_points)
-            min_y = min(point.y() for point in self.crop_points)
-            max_y = max(point.y() for point in self.crop_points)
-            
-            # 创建新的图像，用背景色填充
-            new_image = QImage(max_x - min_x, max_y - min_y, QImage.Format_ARGB32)
-            new_image.fill(self.bg_color)
-            
-            # 创建多边形路径
-            path = QPainterPath()
-            if self.crop_points:
-                path.moveTo(self.crop_points[0].x() - min_x, self.crop_points[0].y() - min_y)
-                for point in self.crop_points[1:]:
-                    path.lineTo(point.x() - min_x, point.y() - min_y)
-                path.closeSubpath()
-            
-            # 在新图像上绘制裁剪区域的内容
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.Antialiasing)
-            painter.setClipPath(path)
-            painter.drawImage(0, 0, image, min_x, min_y, max_x - min_x, max_y - min_y)
-            painter.end()
-            
-            # 更新画布图像
-            self.image = QPixmap.fromImage(new_image)
-            # 调整画布组件尺寸以匹配新图像大小（保持当前缩放）
-            self._apply_zoom()
-            self.mark_content_modified()
+            # 裁剪到多边形的外接矩形，多边形外部用背景色填充
+            points = list(self.crop_points)
+            background = QColor(self.bg_color)
+            self.run_operation(
+                "裁剪", lambda tiled, progress: tiled.assign(polygon_cropped(tiled, points, background)),
+                self._content_changed)
         
         # 清除裁剪状态
         self.crop_points = []
-        self.update()
+        self.request_repaint()
     
     def finish_polygon(self):
         """完成多边形绘制（对标画图）"""
@@ -2013,7 +2357,9 @@ class PaintCanvas(QWidget):
             self.cancel_polygon()
             return
         
-        painter = QPainter(self.image)
+        # 多边形的外接矩形（按线宽外扩），只绘制到相交的图块
+        polygon = QPolygon(self.polygon_points)
+        painter = self.image.begin_paint(self._padded_rect(polygon.boundingRect(), self.pen_width))
         painter.setRenderHint(QPainter.Antialiasing)
         
         # 根据最后使用的鼠标按钮确定颜色
@@ -2034,10 +2380,8 @@ class PaintCanvas(QWidget):
             painter.setBrush(QBrush(draw_color))
         
         # 使用QPolygon绘制闭合多边形
-        from PyQt5.QtGui import QPolygon
-        polygon = QPolygon(self.polygon_points)
         painter.drawPolygon(polygon)
-        painter.end()
+        self.image.end_paint(painter)
         
         self.mark_content_modified()
         
@@ -2047,7 +2391,7 @@ class PaintCanvas(QWidget):
         self.polygon_preview = None
         self.temp_image = None
         self._last_polygon_click_time = 0
-        self.update()
+        self.request_repaint()
     
     def cancel_polygon(self):
         """取消多边形绘制"""
@@ -2055,38 +2399,27 @@ class PaintCanvas(QWidget):
         self.polygon_points = []
         self.polygon_preview = None
         if self.temp_image:
-            self.image = self.temp_image.copy()
-        self.update()
+            self.image.restore(self.temp_image)
+        self.request_repaint()
     
-    def catmull_rom_spline(self, p0, p1, p2, p3, num_points=20):
-        """
-        计算Catmull-Rom样条曲线上的点
-        p0, p1, p2, p3: 四个控制点 (QPoint)
-        num_points: 在p1和p2之间生成的点数
-        返回: 点的列表
-        """
-        points = []
-        for i in range(num_points + 1):
-            t = i / num_points
-            t2 = t * t
-            t3 = t2 * t
-            
-            # Catmull-Rom 样条公式
-            x = 0.5 * (
-                (2 * p1.x()) +
-                (-p0.x() + p2.x()) * t +
-                (2*p0.x() - 5*p1.x() + 4*p2.x() - p3.x()) * t2 +
-                (-p0.x() + 3*p1.x() - 3*p2.x() + p3.x()) * t3
-            )
-            y = 0.5 * (
-                (2 * p1.y()) +
-                (-p0.y() + p2.y()) * t +
-                (2*p0.y() - 5*p1.y() + 4*p2.y() - p3.y()) * t2 +
-                (-p0.y() + 3*p1.y() - 3*p2.y() + p3.y()) * t3
-            )
-            points.append(QPoint(int(x), int(y)))
-        
-        return points
+    def _curve_path(self, points):
+        """控制点对应的样条曲线路径，控制点不变时直接返回缓存"""
+        key = tuple((p.x(), p.y()) for p in points)
+        if self._curve_path_cache is None or self._curve_path_cache[0] != key:
+            self._curve_path_cache = (key, polyline_path(catmull_rom_curve(points)))
+        return self._curve_path_cache[1]
+    
+    def _cached_polygon(self, name, points):
+        """返回与顶点列表对应的QPolygon，同一列表只追加了新点时只把新点加入缓存"""
+        cached = self._polygon_cache.get(name)
+        if (cached is None or cached[0] is not points or cached[1].size() > len(points)
+                or (cached[1].size() and cached[1].point(0) != points[0])):
+            cached = (points, QPolygon())
+            self._polygon_cache[name] = cached
+        polygon = cached[1]
+        for point in points[polygon.size():]:
+            polygon.append(point)
+        return polygon
     
     def draw_catmull_rom_curve(self, points, painter=None):
         """
@@ -2097,47 +2430,24 @@ class PaintCanvas(QWidget):
         if len(points) < 2:
             return
         
+        path = self._curve_path(points)
+        
         should_end = False
         if painter is None:
-            painter = QPainter(self.image)
+            # 曲线可能超出控制点范围，按实际曲线计算需要绘制的区域
+            bounds = path.boundingRect().toAlignedRect()
+            painter = self.image.begin_paint(self._padded_rect(bounds, self.pen_width))
             painter.setRenderHint(QPainter.Antialiasing)
             should_end = True
         
         # 根据鼠标按钮确定颜色
         draw_color = self.pen_color if self.curve_button == Qt.LeftButton else self.bg_color
         painter.setPen(QPen(draw_color, self.pen_width, self.pen_style, Qt.RoundCap, Qt.RoundJoin))
-        
-        if len(points) == 2:
-            # 只有两个点，绘制直线
-            painter.drawLine(points[0], points[1])
-        elif len(points) == 3:
-            # 三个点，使用第一个点作为虚拟起点
-            curve_points = self.catmull_rom_spline(points[0], points[0], points[1], points[2])
-            for i in range(len(curve_points) - 1):
-                painter.drawLine(curve_points[i], curve_points[i + 1])
-            curve_points = self.catmull_rom_spline(points[0], points[1], points[2], points[2])
-            for i in range(len(curve_points) - 1):
-                painter.drawLine(curve_points[i], curve_points[i + 1])
-        else:
-            # 四个或更多点，绘制完整的Catmull-Rom样条
-            # 第一段：使用第一个点作为虚拟起点
-            curve_points = self.catmull_rom_spline(points[0], points[0], points[1], points[2])
-            for i in range(len(curve_points) - 1):
-                painter.drawLine(curve_points[i], curve_points[i + 1])
-            
-            # 中间段
-            for i in range(len(points) - 3):
-                curve_points = self.catmull_rom_spline(points[i], points[i+1], points[i+2], points[i+3])
-                for j in range(len(curve_points) - 1):
-                    painter.drawLine(curve_points[j], curve_points[j + 1])
-            
-            # 最后一段：使用最后一个点作为虚拟终点
-            curve_points = self.catmull_rom_spline(points[-3], points[-2], points[-1], points[-1])
-            for i in range(len(curve_points) - 1):
-                painter.drawLine(curve_points[i], curve_points[i + 1])
+        painter.setBrush(Qt.NoBrush)
+        painter.drawPath(path)
         
         if should_end:
-            painter.end()
+            self.image.end_paint(painter)
     
     def finish_curve(self):
         """完成曲线绘制"""
@@ -2157,7 +2467,7 @@ class PaintCanvas(QWidget):
         self.curve_button = None
         self._last_curve_click_time = 0
         self.temp_image = None
-        self.update()
+        self.request_repaint()
     
     def cancel_curve(self):
         """取消曲线绘制"""
@@ -2166,28 +2476,31 @@ class PaintCanvas(QWidget):
         self.curve_button = None
         self._last_curve_click_time = 0
         if self.temp_image:
-            self.image = self.temp_image.copy()
-        self.update()
+            self.image.restore(self.temp_image)
+        self.request_repaint()
     
     def capture_selection_content(self):
         """捕获选区内容"""
         if self.selection_active and not self.selection_rect.isEmpty():
-            # 捕获选区内的图像内容
-            self.selection_content = self.image.copy(self.selection_rect)
+            # 捕获选区内的图像内容（只读取选区覆盖的图块）
+            self.selection_content = QPixmap.fromImage(self.image.copy(self.selection_rect))
+            self.selection_transform = QTransform()
+            self.selection_mask = SelectionMask.from_rect(self.selection_rect)
             # 在原始图像上清空选区区域（用背景色填充）
-            painter = QPainter(self.image)
+            painter = self.image.begin_paint(self.selection_rect)
             painter.setPen(Qt.NoPen)
             painter.setBrush(self.bg_color)
             painter.drawRect(self.selection_rect)
-            painter.end()
+            self.image.end_paint(painter)
     
     def commit_selection(self):
         """提交选区内容到画布"""
         if self.selection_active and self.selection_content is not None:
-            # 将选区内容绘制回画布
-            painter = QPainter(self.image)
-            painter.drawPixmap(self.selection_rect.topLeft(), self.selection_content)
-            painter.end()
+            # 按累计变换重采样一次，再绘制回画布
+            content = self.floating_image(self.selection_content, self.selection_transform)
+            painter = self.image.begin_paint(QRect(self.selection_rect.topLeft(), content.size()))
+            painter.drawImage(self.selection_rect.topLeft(), content)
+            self.image.end_paint(painter)
             self.mark_content_modified()
         
         # 清除选区
@@ -2198,12 +2511,143 @@ class PaintCanvas(QWidget):
         self.selection_active = False
         self.selection_rect = QRect()
         self.selection_content = None
+        self.selection_transform = QTransform()
+        self.selection_mask = None
         self.selection_transform_mode = None
-        self.update()
+        self.request_repaint()
     
+    def _placement(self, content, transform):
+        """原始内容按累计变换绘制时使用的变换（变换后外接矩形的左上角对齐原点）和外接矩形尺寸"""
+        bounds = transform.mapRect(content.rect())
+        return transform * QTransform.fromTranslate(-bounds.x(), -bounds.y()), bounds.size()
+
+    def floating_image(self, content, transform):
+        """浮动内容按累计变换重采样后的QImage，直角旋转和翻转的组合不重采样"""
+        return transformed_image(content.toImage(), transform)
+
+    def _floating_selection(self):
+        """当前浮动选区的(原始内容, 累计变换, 内容当前的左上角, 掩码)，没有浮动选区时返回None
+
+        矩形选区和任意形状选区都带有位于原始位置、未经变换的SelectionMask，
+        选区上的运算只通过这个接口读取，不区分选区的种类。
+        """
+        if self.selection_active and self.selection_content is not None:
+            return (self.selection_content, self.selection_transform, self.selection_rect.topLeft(),
+                    self.selection_mask)
+        if self.crop_selection_active and self.crop_selection_content is not None:
+            return (self.crop_selection_content, self.crop_selection_transform,
+                    self.crop_selection_rect.translated(self.crop_selection_offset).topLeft(),
+                    self.crop_selection_mask)
+        return None
+
+    def _set_floating_selection(self, content, transform):
+        """替换浮动选区的原始内容和累计变换，选区矩形随之适应变换后的尺寸"""
+        size = self._placement(content, transform)[1]
+        if self.selection_active and self.selection_content is not None:
+            self.selection_content, self.selection_transform = content, transform
+            self.selection_rect.setSize(size)
+        else:
+            self.crop_selection_content, self.crop_selection_transform = content, transform
+            self.crop_selection_rect.setSize(size)
+
+    def preview_proxy(self, max_side=192):
+        """变换对话框预览用的缩小图和填充色：有浮动选区时是选区当前的样子，否则是整幅画布
+
+        按文档对象、修订号和选区内容缓存，反复打开对话框或调整参数都复用同一张缩小图。
+        新建、打开或改变画布尺寸都会换成新的文档对象（修订号从0开始），键中保留对象本身，
+        按身份比较，旧文档的缓存不会被误用。
+        """
+        floating = self._floating_selection()
+        content, transform = floating[:2] if floating is not None else (None, None)
+        key = (self.image, self.image.revision, content.cacheKey() if content is not None else None,
+               transform, max_side, QColor(self.bg_color).rgba())
+        if self._preview_proxy is not None and self._preview_proxy[0] == key:
+            return self._preview_proxy[1]
+        
+        size = content.size() if content is not None else self.image.size()
+        scale = min(1.0, max_side / max(size.width(), size.height(), 1))
+        if content is not None:
+            # 先缩小原始像素再做累计变换，与先变换再缩小等价
+            small = resized_image(content.toImage(), round(size.width() * scale),
+                                  round(size.height() * scale))
+            proxy = (transformed_image(small, transform), Qt.transparent)
+        else:
+            # 逐图块缩小绘制，不拼出整幅图像
+            small = QImage(max(1, round(size.width() * scale)), max(1, round(size.height() * scale)),
+                           QImage.Format_ARGB32)
+            small.fill(self.bg_color)
+            painter = QPainter(small)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.scale(scale, scale)
+            self.image.draw(painter)
+            painter.end()
+            proxy = (small, QColor(self.bg_color))
+        self._preview_proxy = (key, proxy)
+        return proxy
+
+    def _draw_floating(self, painter, pos, content, transform):
+        """在pos处按累计变换绘制浮动内容（QPixmap或QImage），不生成变换后的图像"""
+        placement, size = self._placement(content, transform)
+        painter.save()
+        painter.translate(pos)
+        if not placement.isIdentity():
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.setTransform(placement, True)
+        if isinstance(content, QImage):
+            painter.drawImage(0, 0, content)
+        else:
+            painter.drawPixmap(0, 0, content)
+        painter.restore()
+
+    def _selection_bounds(self):
+        """矩形选区（内容和虚线框）覆盖的区域"""
+        rect = self.selection_rect.normalized()
+        if self.selection_content is not None:
+            size = self._placement(self.selection_content, self.selection_transform)[1]
+            rect = rect.united(QRect(self.selection_rect.topLeft(), size))
+        return rect
+
+    def _crop_selection_bounds(self):
+        """任意形状选区（内容和虚线边框）当前覆盖的区域"""
+        rect = self.crop_selection_rect.translated(self.crop_selection_offset)
+        if self.crop_selection_content is not None:
+            size = self._placement(self.crop_selection_content, self.crop_selection_transform)[1]
+            rect = rect.united(QRect(rect.topLeft(), size))
+        return rect
+
     def is_point_in_selection(self, pos):
         """检查点是否在选区内"""
         return self.selection_active and self.selection_rect.contains(pos)
+
+    def _floating_pixel(self, pos, content, transform, origin):
+        """把文档坐标pos映射为浮动内容原始像素的坐标，origin 为内容当前外接矩形的左上角
+
+        内容经过累计变换时按逆变换映射像素中心；变换不可逆时返回None。
+        """
+        local = pos - origin
+        if not transform.isIdentity():
+            placement = self._placement(content, transform)[0]
+            inverse, invertible = placement.inverted()
+            if not invertible:
+                return None
+            center = inverse.map(QPointF(local.x() + 0.5, local.y() + 0.5))
+            local = QPoint(math.floor(center.x()), math.floor(center.y()))
+        return local
+    
+    def _simplify_crop_points(self, final=False):
+        """用RDP简化任意形状选区尚未定稿的尾部顶点
+
+        绘制过程中未定稿的顶点每积累 crop_simplify_chunk 个简化一次，简化后保留下来的顶点
+        （除了仍是当前终点的最后一个）不再变化；final 为True时简化剩余的全部尾部。
+        """
+        tail = self.crop_points[self._crop_settled:]
+        if len(tail) < (3 if final else self.crop_simplify_chunk):
+            return
+        keep = simplify_polyline([(p.x(), p.y()) for p in tail])
+        self.crop_points[self._crop_settled:] = [p for p, kept in zip(tail, keep) if kept]
+        self._crop_settled = len(self.crop_points) - 1
+        # 已缓存的预览折线中间部分变了，下次绘制时重建
+        self._polygon_cache.pop("crop", None)
     
     def capture_crop_selection_content(self):
         """捕获任意形状选区内容"""
@@ -2220,64 +2664,48 @@ class PaintCanvas(QWidget):
             max_x = min(self.image.width(), max_x)
             max_y = min(self.image.height(), max_y)
             
-            width = max_x - min_x
-            height = max_y - min_y
-            
-            if width <= 0 or height <= 0:
-                return
-            
-            # 保存原始边界矩形
-            self.crop_selection_rect = QRect(min_x, min_y, width, height)
-            
-            # 保存原始顶点位置（相对于边界矩形左上角）
-            self.crop_selection_original_points = [
-                QPoint(p.x() - min_x, p.y() - min_y) for p in self.crop_points
-            ]
-            
-            # 创建选区内容图像（带透明背景）
-            content_image = QImage(width, height, QImage.Format_ARGB32)
-            content_image.fill(Qt.transparent)
-            
-            # 创建多边形路径（相对于边界矩形）
-            path = QPainterPath()
-            if self.crop_points:
-                path.moveTo(self.crop_points[0].x() - min_x, self.crop_points[0].y() - min_y)
-                for point in self.crop_points[1:]:
-                    path.lineTo(point.x() - min_x, point.y() - min_y)
-                path.closeSubpath()
-            
-            # 在内容图像上绘制裁剪区域的内容
-            source_image = self.image.toImage()
-            painter = QPainter(content_image)
-            painter.setRenderHint(QPainter.Antialiasing)
-            painter.setClipPath(path)
-            painter.drawImage(0, 0, source_image, min_x, min_y, width, height)
-            painter.end()
-            
-            # 保存选区内容
-            self.crop_selection_content = QPixmap.fromImage(content_image)
-            self.crop_selection_mask = path
-            
-            # 在原始图像上用背景色填充选区区域
-            painter = QPainter(self.image)
-            painter.setRenderHint(QPainter.Antialiasing)
-            painter.setPen(Qt.NoPen)
-            painter.setBrush(self.bg_color)
-            
-            # 创建原始位置的路径
-            original_path = QPainterPath()
-            if self.crop_points:
-                original_path.moveTo(self.crop_points[0])
-                for point in self.crop_points[1:]:
-                    original_path.lineTo(point)
-                original_path.closeSubpath()
-            painter.drawPath(original_path)
-            painter.end()
-            
-            # 重置偏移量
-            self.crop_selection_offset = QPoint(0, 0)
-            self.crop_selection_active = True
-            self.mark_content_modified()
+            # 把多边形光栅化为选区掩码，与按住Shift/Alt开始绘制时的原选区组合
+            rect = QRect(min_x, min_y, max_x - min_x, max_y - min_y)
+            mask = SelectionMask.from_polygon(self.crop_points, rect)
+            outline = self.crop_points
+            base = self._crop_combine_base
+            if base is not None:
+                mask = base.united(mask) if self._crop_combine == "add" else base.subtracted(mask)
+                outline = None
+            self._crop_combine = None
+            self._crop_combine_base = None
+            self.capture_mask_selection(mask, outline)
+    
+    def capture_mask_selection(self, mask, outline=None):
+        """把掩码选中的内容取出为浮动的任意形状选区，原位置用背景色填充
+
+        mask 为SelectionMask，超出画布的部分被忽略；outline 为选区边框的顶点（文档坐标），
+        没有顶点时按掩码绘制边框。选区为空时返回False。
+        """
+        mask = mask.intersected(SelectionMask.from_rect(self.image.rect())).cropped()
+        if mask.isEmpty():
+            self.clear_crop_selection()
+            return False
+        self.crop_selection_rect = QRect(mask.rect)
+        self.crop_selection_mask = mask
+        # 保存边框顶点（相对于外接矩形左上角）
+        self.crop_selection_original_points = [p - mask.rect.topLeft() for p in outline or []]
+        
+        # 只读取外接矩形覆盖的图块，掩码外的部分设为透明
+        content_image = self.image.copy(mask.rect)
+        apply_alpha_mask(content_image, mask.alpha_image())
+        self.crop_selection_content = QPixmap.fromImage(content_image)
+        self.crop_selection_transform = QTransform()
+        
+        # 在原始图像上用背景色填充选区区域
+        fill_tiled_mask(self.image, mask.rect, mask.bits, self.bg_color)
+        
+        # 重置偏移量
+        self.crop_selection_offset = QPoint(0, 0)
+        self.crop_selection_active = True
+        self.mark_content_modified()
+        self.request_repaint()
+        return True
     
     def commit_crop_selection(self):
         """提交任意形状选区内容到画布"""
@@ -2285,11 +2713,11 @@ class PaintCanvas(QWidget):
             # 计算当前选区位置
             current_rect = self.crop_selection_rect.translated(self.crop_selection_offset)
             
-            # 将选区内容绘制回画布
-            painter = QPainter(self.image)
-            painter.setRenderHint(QPainter.Antialiasing)
-            painter.drawPixmap(current_rect.topLeft(), self.crop_selection_content)
-            painter.end()
+            # 按累计变换重采样一次，再绘制回画布
+            content = self.floating_image(self.crop_selection_content, self.crop_selection_transform)
+            painter = self.image.begin_paint(QRect(current_rect.topLeft(), content.size()))
+            painter.drawImage(current_rect.topLeft(), content)
+            self.image.end_paint(painter)
             self.mark_content_modified()
         
         # 清除选区
@@ -2299,6 +2727,7 @@ class PaintCanvas(QWidget):
         """清除任意形状选区"""
         self.crop_selection_active = False
         self.crop_selection_content = None
+        self.crop_selection_transform = QTransform()
         self.crop_selection_mask = None
         self.crop_selection_rect = QRect()
         self.crop_selection_offset = QPoint(0, 0)
@@ -2306,7 +2735,7 @@ class PaintCanvas(QWidget):
         self.crop_selection_dragging = False
         self.crop_points = []
         self.crop_drawing = False
-        self.update()
+        self.request_repaint()
     
     def is_point_in_crop_selection(self, pos):
         """检查点是否在任意形状选区内"""
@@ -2316,18 +2745,74 @@ class PaintCanvas(QWidget):
         # 计算当前选区的边界矩形
         current_rect = self.crop_selection_rect.translated(self.crop_selection_offset)
         
-        # 如果没有mask（如粘贴后），使用边界矩形判断
-        # 这样即使没有 crop_selection_mask（如粘贴后），也能正常拖动
+        # 如果没有mask，使用边界矩形判断，保证选区仍能正常拖动
         if self.crop_selection_mask is None:
             return current_rect.contains(pos)
         
-        # 首先检查是否在边界矩形内
-        if not current_rect.contains(pos):
+        # 掩码位于选区的原始位置且未经变换：把点按累计变换的逆变换映射回去，
+        # 直接读取对应像素的掩码值，与选区形状无关
+        local = self._floating_pixel(pos, self.crop_selection_content, self.crop_selection_transform,
+                                     current_rect.topLeft())
+        if local is None:
             return False
-        
-        # 检查是否在多边形路径内（需要转换到选区本地坐标系）
-        local_pos = pos - current_rect.topLeft()
-        return self.crop_selection_mask.contains(local_pos)
+        return self.crop_selection_mask.contains(self.crop_selection_mask.rect.topLeft() + local)
+    
+    def _selection_combine_mode(self, modifiers):
+        """按键修饰对应的选区组合方式：Shift添加，Alt减去"""
+        if modifiers & Qt.ShiftModifier:
+            return "add"
+        if modifiers & Qt.AltModifier:
+            return "subtract"
+        return None
+    
+    def magic_wand_select(self, pos, combine=None):
+        """魔棒：选中与点击处颜色相近的区域，combine 为"add"或"subtract"时与当前选区组合
+
+        连续模式用扫描线区域生长只选相连部分，否则选中整幅图中所有颜色相近的像素。
+        """
+        if not self.image.rect().contains(pos):
+            return False
+        base = self.current_selection_mask() if combine else None
+        self.save_state()  # 操作前保存状态
+        # 先把浮动的选区内容放回画布，再按画布当前内容取色
+        self.commit_selection()
+        self.commit_crop_selection()
+        
+        target = self.image.pixelColor(pos.x(), pos.y())
+        match = tiled_match_mask(self.image, color_bgra(target), self.wand_tolerance)
+        if self.wand_contiguous:
+            region, bounds = flood_fill_region(match, pos.x(), pos.y())
+        else:
+            region, bounds = match, mask_bounds(match)
+        left, top, right, bottom = bounds
+        mask = SelectionMask.from_bool(region[top:bottom + 1, left:right + 1], QPoint(left, top))
+        if base is not None:
+            mask = base.united(mask) if combine == "add" else base.subtracted(mask)
+        return self.capture_mask_selection(mask)
+    
+    def current_selection_mask(self):
+        """当前浮动选区在现在位置上的掩码，没有选区时返回None"""
+        floating = self._floating_selection()
+        if floating is None:
+            return None
+        content, transform, origin, mask = floating
+        if not transform.isIdentity():
+            mask = mask.mapped(lambda alpha: transformed_image(alpha, transform))
+        return mask.translated(origin - mask.rect.topLeft())
+    
+    def modify_selection(self, operation):
+        """对当前选区的掩码执行运算 operation(SelectionMask) -> SelectionMask，结果作为新的任意形状选区
+
+        原选区内容先放回画布，再按新掩码重新取出，矩形选区也因此变为任意形状选区。
+        """
+        mask = self.current_selection_mask()
+        if mask is None:
+            return False
+        self.save_state()  # 操作前保存状态
+        self.commit_selection()
+        self.commit_crop_selection()
+        return self.capture_mask_selection(operation(mask))
+    
     def copy_selection(self):
         """复制选区内容到剪贴板"""
         clipboard = QApplication.clipboard()
@@ -2335,16 +2820,26 @@ class PaintCanvas(QWidget):
         
         # 首先检查任意形状选区
         if self.crop_selection_active and self.crop_selection_content is not None:
-            # 保存任意形状选区内容和形状信息
-            mime_data.setImageData(self.crop_selection_content.toImage())
-            
-            # 保存选区类型和形状数据
-            shape_data = {
-                'type': 'crop',
-                'points': [(p.x(), p.y()) for p in self.crop_points],
-                'original_points': [(p.x(), p.y()) for p in self.crop_selection_original_points] if hasattr(self, 'crop_selection_original_points') else [],
-                'offset': (self.crop_selection_offset.x(), self.crop_selection_offset.y())
-            }
+            # 保存任意形状选区内容（按累计变换重采样）和形状信息
+            mime_data.setImageData(self.floating_image(self.crop_selection_content,
+                                                       self.crop_selection_transform))
+            
+            # 保存选区类型和形状数据；没有边框顶点或经过变换的选区按矩形保存，
+            # 形状由内容的透明度保留
+            if (len(self.crop_selection_original_points) >= 3
+                    and self.crop_selection_transform.isIdentity()):
+                shape_data = {
+                    'type': 'crop',
+                    'points': [(p.x(), p.y()) for p in self.crop_points],
+                    'original_points': [(p.x(), p.y()) for p in self.crop_selection_original_points],
+                    'offset': (self.crop_selection_offset.x(), self.crop_selection_offset.y())
+                }
+            else:
+                rect = self._crop_selection_bounds()
+                shape_data = {
+                    'type': 'rect',
+                    'rect': (rect.x(), rect.y(), rect.width(), rect.height())
+                }
             mime_data.setData('application/x-custom-selection-shape', json.dumps(shape_data).encode())
             
             clipboard.setMimeData(mime_data)
@@ -2352,8 +2847,8 @@ class PaintCanvas(QWidget):
         
         # 然后检查矩形选区
         if self.selection_active and self.selection_content is not None:
-            # 保存矩形选区内容
-            mime_data.setImageData(self.selection_content.toImage())
+            # 保存矩形选区内容（按累计变换重采样）
+            mime_data.setImageData(self.floating_image(self.selection_content, self.selection_transform))
             
             # 保存选区类型和矩形信息
             shape_data = {
@@ -2372,7 +2867,7 @@ class PaintCanvas(QWidget):
         # 首先检查任意形状选区
         if self.crop_selection_active and self.crop_selection_content is not None:
             clipboard = QApplication.clipboard()
-            clipboard.setPixmap(self.crop_selection_content)
+            clipboard.setImage(self.floating_image(self.crop_selection_content, self.crop_selection_transform))
             # 清除选区（背景已经在捕获时填充）
             self.clear_crop_selection()
             self.mark_content_modified()
@@ -2381,11 +2876,11 @@ class PaintCanvas(QWidget):
         if self.copy_selection():
             # 清空选区区域
             if self.selection_active:
-                painter = QPainter(self.image)
+                painter = self.image.begin_paint(self.selection_rect)
                 painter.setPen(Qt.NoPen)
                 painter.setBrush(self.bg_color)
                 painter.drawRect(self.selection_rect)
-                painter.end()
+                self.image.end_paint(painter)
                 self.mark_content_modified()
                 self.clear_selection()
             return True
@@ -2435,8 +2930,8 @@ class PaintCanvas(QWidget):
                     
                     if len(points) >= 3:
                         self.crop_points = points
-                        self.crop_selection_original_points = original_points if original_points else points
                         self.crop_selection_content = pixmap
+                        self.crop_selection_transform = QTransform()
                         self.crop_selection_offset = QPoint(offset_x, offset_y)
                         
                         # 计算边界矩形
@@ -2446,6 +2941,13 @@ class PaintCanvas(QWidget):
                         max_y = max(p.y() for p in points)
                         self.crop_selection_rect = QRect(min_x, min_y, max_x - min_x, max_y - min_y)
                         
+                        # 顶点相对于边界矩形左上角保存，并重建选区掩码用于点击判断
+                        self.crop_selection_original_points = original_points if original_points else [
+                            QPoint(p.x() - min_x, p.y() - min_y) for p in points]
+                        self.crop_selection_mask = SelectionMask.from_polygon(
+                            self.crop_selection_original_points, QRect(QPoint(0, 0), pixmap.size())
+                        ).translated(self.crop_selection_rect.topLeft())
+                        
                         self.crop_selection_active = True
                         self.crop_selection_dragging = False
                         
@@ -2473,6 +2975,8 @@ class PaintCanvas(QWidget):
                         self.selection_rect = QRect(x, y, pixmap.width(), pixmap.height())
                     
                     self.selection_content = pixmap
+                    self.selection_transform = QTransform()
+                    self.selection_mask = SelectionMask.from_rect(self.selection_rect)
                     self.selection_active = True
                     self.selection_transform_mode = "move"
                     
@@ -2501,11 +3005,13 @@ class PaintCanvas(QWidget):
             y = center_y - pixmap.height() // 2
             
             self.selection_content = pixmap
+            self.selection_transform = QTransform()
             self.selection_rect = QRect(x, y, pixmap.width(), pixmap.height())
+            self.selection_mask = SelectionMask.from_rect(self.selection_rect)
             self.selection_active = True
             self.selection_transform_mode = "move"
             
-        self.update()
+        self.request_repaint()
         return True
         
     def paintEvent(self, event):
@@ -2515,12 +3021,27 @@ class PaintCanvas(QWidget):
         if self.zoom_factor != 1.0:
             painter.scale(self.zoom_factor, self.zoom_factor)
 
-        # 绘制图像（按原尺寸，不拉伸）
-        painter.drawPixmap(0, 0, self.image)
+        # 需要重绘的区域（图像坐标），只绘制与之相交的图块和覆盖层
+        exposed = self._widget_rect_to_image(event.rect())
+
+        # 绘制图像（逐图块绘制，按原尺寸，不拉伸）
+        self.image.draw(painter, exposed)
         
-        # 绘制矩形选区内容（如果有）
+        # 绘制矩形选区内容（如果有），经过变换的内容按累计变换直接绘制原始像素
         if self.selection_active and self.selection_content is not None:
-            painter.drawPixmap(self.selection_rect.topLeft(), self.selection_content)
+            if exposed.intersects(self._selection_bounds()):
+                self._draw_floating(painter, self.selection_rect.topLeft(),
+                                    self.selection_content, self.selection_transform)
+        
+        # 绘制形状预览（覆盖层，不修改文档）
+        if (self.drawing and self._shape_preview_end is not None
+                and self.current_tool in ["line", "rectangle", "ellipse", "rounded"]):
+            draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
+            painter.save()
+            painter.setPen(QPen(draw_color, self.pen_width,
+                               self.pen_style, Qt.RoundCap, Qt.RoundJoin))
+            self.draw_shape(painter, self.start_point, self._shape_preview_end)
+            painter.restore()
         
         # 如果是文字模式且正在输入，绘制文本框
         if self.is_text_mode and self.text_start_point and self.text_content:
@@ -2539,8 +3060,7 @@ class PaintCanvas(QWidget):
         # 绘制任意形状选区（正在绘制中）
         if self.crop_drawing and len(self.crop_points) > 1:
             painter.setPen(QPen(Qt.blue, 1, Qt.DashLine))
-            for i in range(len(self.crop_points) - 1):
-                painter.drawLine(self.crop_points[i], self.crop_points[i + 1])
+            painter.drawPolyline(self._cached_polygon("crop", self.crop_points))
             # 如果正在绘制，连接最后一个点与当前鼠标位置
             if self.drawing and self.current_tool == "crop" and len(self.crop_points) > 1:
                 painter.drawLine(self.crop_points[-1], self.last_point)
@@ -2551,7 +3071,9 @@ class PaintCanvas(QWidget):
             current_rect = self.crop_selection_rect.translated(self.crop_selection_offset)
             
             # 绘制选区内容
-            painter.drawPixmap(current_rect.topLeft(), self.crop_selection_content)
+            if exposed.intersects(self._crop_selection_bounds()):
+                self._draw_floating(painter, current_rect.topLeft(),
+                                    self.crop_selection_content, self.crop_selection_transform)
             
             # 绘制选区边框（虚线多边形）
             painter.setPen(QPen(Qt.blue, 1, Qt.DashLine))
@@ -2559,11 +3081,19 @@ class PaintCanvas(QWidget):
             
             # 绘制多边形边框
             if len(self.crop_selection_original_points) >= 3:
+                # 顶点相对选区左上角保存，移动选区只需平移坐标系，缓存不受偏移影响；
+                # 经过变换时顶点按累计变换映射，线宽不随变换缩放
+                polygon = self._cached_polygon("crop_selection", self.crop_selection_original_points)
+                if not self.crop_selection_transform.isIdentity():
+                    polygon = self._placement(self.crop_selection_content, self.crop_selection_transform)[0].map(polygon)
                 offset = current_rect.topLeft()
-                for i in range(len(self.crop_selection_original_points)):
-                    p1 = self.crop_selection_original_points[i] + offset
-                    p2 = self.crop_selection_original_points[(i + 1) % len(self.crop_selection_original_points)] + offset
-                    painter.drawLine(p1, p2)
+                painter.translate(offset)
+                painter.drawPolygon(polygon)
+                painter.translate(-offset)
+            elif self.crop_selection_mask is not None:
+                # 由掩码运算得到的选区没有顶点，绘制按掩码生成的边框图像
+                self._draw_floating(painter, current_rect.topLeft(),
+                                    self.crop_selection_mask.outline_image(), self.crop_selection_transform)
         
         # 绘制多边形预览（对标画图）
         if self.polygon_drawing and len(self.polygon_points) > 0:
@@ -2574,8 +3104,7 @@ class PaintCanvas(QWidget):
             
             # 绘制已确定的边（实线）
             painter.setPen(QPen(draw_color, self.pen_width, self.pen_style, Qt.RoundCap, Qt.RoundJoin))
-            for i in range(len(self.polygon_points) - 1):
-                painter.drawLine(self.polygon_points[i], self.polygon_points[i + 1])
+            painter.drawPolyline(self._cached_polygon("polygon", self.polygon_points))
             
             # 绘制预览线（虚线，到鼠标位置）
             if hasattr(self, '_last_mouse_pos') and self._last_mouse_pos:
@@ -2623,23 +3152,13 @@ class PaintCanvas(QWidget):
                     temp_color.setAlpha(128)  # 半透明
                     painter.setPen(QPen(temp_color, 1, Qt.DashLine))
                     
-                    if len(preview_points) == 2:
-                        painter.drawLine(preview_points[0], preview_points[1])
-                    elif len(preview_points) == 3:
-                        curve_points = self.catmull_rom_spline(preview_points[0], preview_points[0], 
-                                                               preview_points[1], preview_points[2], 10)
-                        for i in range(len(curve_points) - 1):
-                            painter.drawLine(curve_points[i], curve_points[i + 1])
-                        curve_points = self.catmull_rom_spline(preview_points[0], preview_points[1], 
-                                                               preview_points[2], preview_points[2], 10)
-                        for i in range(len(curve_points) - 1):
-                            painter.drawLine(curve_points[i], curve_points[i + 1])
+                    painter.setBrush(Qt.NoBrush)
+                    if len(preview_points) <= 3:
+                        painter.drawPath(polyline_path(catmull_rom_curve(preview_points)))
                     else:
                         # 绘制最后一段预览
-                        curve_points = self.catmull_rom_spline(preview_points[-4], preview_points[-3], 
-                                                               preview_points[-2], preview_points[-1], 10)
-                        for i in range(len(curve_points) - 1):
-                            painter.drawLine(curve_points[i], curve_points[i + 1])
+                        controls = np.array([(p.x(), p.y()) for p in preview_points[-4:]], dtype=float)
+                        painter.drawPath(polyline_path(catmull_rom_polyline(*controls[:, None])))
             
             # 绘制控制点标记
             painter.setPen(QPen(draw_color, 1, Qt.SolidLine))
@@ -2652,8 +3171,10 @@ class PaintCanvas(QWidget):
                     # 其他点用圆点标记
                     painter.drawEllipse(point, 3, 3)
 
-        # 绘制调整大小控制点
-        if not self.drawing and not self.selection_active and not self.crop_drawing:
+        # 绘制调整大小控制点（控制点都在右侧和下侧边缘，重绘区域不含边缘时跳过）
+        handle_free_rect = QRect(0, 0, self.image.width() - self.resize_handle_size,
+                                 self.image.height() - self.resize_handle_size)
+        if not handle_free_rect.contains(exposed) and not self.drawing and not self.selection_active and not self.crop_drawing:
             # 只在没有其他交互时显示控制点
             painter.setPen(QPen(Qt.blue, 1, Qt.SolidLine))
             painter.setBrush(QBrush(QColor(200, 200, 255, 200)))
@@ -2679,6 +3200,10 @@ class PaintCanvas(QWidget):
             painter.drawRect(corner_x, corner_y, handle_size, handle_size)
     
     def mousePressEvent(self, event):
+        # 后台操作执行期间锁定画布输入
+        if self.operation_worker is not None:
+            return
+        
         # ── 放大镜工具：左键放大，右键缩小，不进入绘图流程 ──
         if self.current_tool == "magnifier":
             if event.button() == Qt.LeftButton:
@@ -2731,47 +3256,55 @@ class PaintCanvas(QWidget):
                     self.resizing_mode = "right"
                     self.resizing_start_pos = pos
                     self.original_size = self.image.size()
-                    self.original_image = self.image.copy()
+                    self.original_image = self.image
                     return
                 elif bottom_rect.contains(pos):
                     self.save_state()  # 操作前保存状态
                     self.resizing_mode = "bottom"
                     self.resizing_start_pos = pos
                     self.original_size = self.image.size()
-                    self.original_image = self.image.copy()
+                    self.original_image = self.image
                     return
                 elif corner_rect.contains(pos):
                     self.save_state()  # 操作前保存状态
                     self.resizing_mode = "corner"
                     self.resizing_start_pos = pos
                     self.original_size = self.image.size()
-                    self.original_image = self.image.copy()
+                    self.original_image = self.image
                     return
             
-            # 优先检查是否点击在异型选区内（任何工具下都可以拖动异型选区）
-            if self.crop_selection_active and self.is_point_in_crop_selection(event.pos()):
-                # 在异型选区内点击，开始移动选区
+            # 优先检查是否点击在异型选区内（除填充工具外，任何工具下都可以拖动异型选区）
+            combine = self._selection_combine_mode(event.modifiers())
+            if (self.crop_selection_active and self.current_tool != "fill"
+                    and not (self.current_tool in ("crop", "wand") and combine)
+                    and self.is_point_in_crop_selection(event.pos())):
+                # 在异型选区内点击，开始移动选区（任意形状选择和魔棒工具按住Shift/Alt时改为组合选区）
                 self.crop_selection_dragging = True
                 self.selection_start_pos = event.pos()
                 self.drawing = False  # 不是绘制模式
-                self.update()
+                self.request_repaint()
                 return  # 直接返回，不继续处理其他逻辑
             
-            # 检查是否点击在矩形选区内（任何工具下都可以拖动矩形选区）
-            if self.selection_active and self.selection_rect.contains(event.pos()):
+            # 检查是否点击在矩形选区内（除填充工具外，任何工具下都可以拖动矩形选区）
+            if (self.is_point_in_selection(event.pos()) and self.current_tool != "fill"
+                    and not (self.current_tool == "wand" and combine)):
                 # 在矩形选区内点击，开始移动选区
                 self.selection_transform_mode = "move"
                 self.selection_start_pos = event.pos()
                 self.drawing = False  # 不是绘制模式
-                self.update()
+                self.request_repaint()
                 return  # 直接返回，不继续处理其他逻辑
             
+            # 魔棒工具：按颜色建立选区
+            if self.current_tool == "wand":
+                self.magic_wand_select(event.pos(), combine)
+                return
+            
             # 多边形工具的特殊处理（在选区检测之后处理）
             if self.current_tool == "polygon":
                 # 左键和右键都可以绘制多边形
                 if event.button() in [Qt.LeftButton, Qt.RightButton]:
                     # 检测双击（300ms内的第二次点击相同按钮）
-                    import time
                     current_time = time.time() * 1000  # 转换为毫秒
                     time_diff = current_time - self._last_polygon_click_time
                     
@@ -2788,7 +3321,7 @@ class PaintCanvas(QWidget):
                         # 第一次点击，开始绘制
                         self.polygon_drawing = True
                         self.polygon_points = [event.pos()]
-                        self.temp_image = self.image.copy()  # 保存预览图像
+                        self.temp_image = self.image.snapshot()  # 保存预览图像
                         self.last_button = event.button()  # 记录按钮（左键=前景色，右键=背景色）
                     else:
                         # 检查是否切换了按钮（从左键切换到右键或相反）
@@ -2798,14 +3331,14 @@ class PaintCanvas(QWidget):
                             # 开始新的多边形绘制
                             self.polygon_drawing = True
                             self.polygon_points = [event.pos()]
-                            self.temp_image = self.image.copy()
+                            self.temp_image = self.image.snapshot()
                             self.last_button = event.button()
                         else:
                             # 同一个按钮，添加顶点到现有多边形
                             self.polygon_points.append(event.pos())
                     
                     self._last_polygon_click_time = current_time
-                    self.update()
+                    self.request_repaint()
                     return
             
             # 曲线工具的特殊处理（在选区检测之后处理）
@@ -2813,7 +3346,6 @@ class PaintCanvas(QWidget):
                 # 左键和右键都可以绘制曲线
                 if event.button() in [Qt.LeftButton, Qt.RightButton]:
                     # 检测双击（300ms内的第二次点击相同按钮）
-                    import time
                     current_time = time.time() * 1000  # 转换为毫秒
                     time_diff = current_time - self._last_curve_click_time
                     
@@ -2830,7 +3362,7 @@ class PaintCanvas(QWidget):
                         # 第一次点击，开始绘制
                         self.curve_drawing = True
                         self.curve_points = [event.pos()]
-                        self.temp_image = self.image.copy()  # 保存预览图像
+                        self.temp_image = self.image.snapshot()  # 保存预览图像
                         self.curve_button = event.button()  # 记录按钮（左键=前景色，右键=背景色）
                     else:
                         # 检查是否切换了按钮（从左键切换到右键或相反）
@@ -2840,14 +3372,14 @@ class PaintCanvas(QWidget):
                             # 开始新的曲线绘制
                             self.curve_drawing = True
                             self.curve_points = [event.pos()]
-                            self.temp_image = self.image.copy()
+                            self.temp_image = self.image.snapshot()
                             self.curve_button = event.button()
                         else:
                             # 同一个按钮，添加控制点到现有曲线
                             self.curve_points.append(event.pos())
                     
                     self._last_curve_click_time = current_time
-                    self.update()
+                    self.request_repaint()
                     return
             
             # 如果没有点击控制点和选区，则进行正常的绘图操作
@@ -2875,9 +3407,9 @@ class PaintCanvas(QWidget):
             self.start_point = event.pos()
             self.last_button = event.button()  # 记录最后使用的鼠标按钮
             
-            # 保存临时图像用于预览
+            # 形状工具的预览画在覆盖层上，松开鼠标前不修改文档
             if self.current_tool in ["line", "rectangle", "ellipse", "rounded"]:
-                self.temp_image = self.image.copy()
+                self._shape_preview_end = None
             
             # 根据鼠标按钮确定绘图颜色
             draw_color = self.pen_color if event.button() == Qt.LeftButton else self.bg_color
@@ -2887,9 +3419,8 @@ class PaintCanvas(QWidget):
                 # 保存当前颜色并设置填充颜色
                 original_color = self.pen_color
                 self.pen_color = draw_color
-                self.flood_fill(event.pos())
+                self.flood_fill(event.pos())  # 确实填充了像素时才标记修改
                 self.pen_color = original_color  # 恢复原始颜色
-                self.mark_content_modified()
             
             # 取色器工具
             if self.current_tool == "eyedropper":
@@ -2898,12 +3429,12 @@ class PaintCanvas(QWidget):
             # 喷枪工具
             if self.current_tool == "airbrush":
                 self.current_spray_pos = event.pos()
-                # 保存当前颜色并设置喷枪颜色
-                original_color = self.pen_color
-                self.pen_color = draw_color
+                self.spray_color = draw_color
+                # 按下时先喷出一个定时器间隔的量
+                self._spray_time = time.monotonic() - self.airbrush_interval / 1000
+                self._spray_carry = 0.0
                 self.spray_paint()
-                self.pen_color = original_color  # 恢复原始颜色
-                self.airbrush_timer.start(50)  # 每50毫秒喷一次
+                self.airbrush_timer.start(self.airbrush_interval)
             
             # 文字工具
             if self.current_tool == "text":
@@ -2971,7 +3502,7 @@ class PaintCanvas(QWidget):
                 # 连接输入框的完成信号
                 self.text_input_widget.returnPressed.connect(self.finish_text_input)
                 
-                self.update()
+                self.request_repaint()
             
             # 矩形选取工具（只有在当前工具是select时才建立新选区）
             if self.current_tool == "select":
@@ -2985,10 +3516,10 @@ class PaintCanvas(QWidget):
                 self.selection_rect.setBottomRight(event.pos())
                 self.selection_dragging = True
                 self.selection_transform_mode = "resize"
-                self.update()
+                self.request_repaint()
             
             # 处理在选区外点击的情况 - 提交当前选区
-            if self.selection_active and not self.selection_rect.contains(event.pos()):
+            if self.selection_active and not self.is_point_in_selection(event.pos()):
                 if self.current_tool != "select":
                     # 非选择工具下，在选区外点击，提交选区
                     self.commit_selection()
@@ -3009,16 +3540,26 @@ class PaintCanvas(QWidget):
                     # 开始新的多边形选区绘制
                     self.crop_drawing = True
                     self.crop_points = [event.pos()]
+                    self._crop_settled = 0
                     self.drawing = True  # 设置绘制状态
-                elif not self.is_point_in_crop_selection(event.pos()):
-                    # 如果已有选区但点击在选区外，先提交再开始新选区
+                elif combine or not self.is_point_in_crop_selection(event.pos()):
+                    # 按住Shift/Alt时记下原选区，绘制完成后与新选区组合
+                    if combine:
+                        self._crop_combine = combine
+                        self._crop_combine_base = self.current_selection_mask()
+                    # 先提交原选区再开始新选区
                     self.commit_crop_selection()
                     self.crop_drawing = True
                     self.crop_points = [event.pos()]
+                    self._crop_settled = 0
                     self.drawing = True
-                self.update()
+                self.request_repaint()
     
     def mouseMoveEvent(self, event):
+        # 后台操作执行期间锁定画布输入
+        if self.operation_worker is not None:
+            return
+        
         # 坐标转换：widget 坐标 → 图像坐标
         _img_pos = self._widget_to_image(event.pos())
         event.pos = lambda: _img_pos
@@ -3047,16 +3588,8 @@ class PaintCanvas(QWidget):
                 new_width = max(self.original_size.width() + delta_x, 1)
                 new_height = max(self.original_size.height() + delta_y, 1)
             
-            # 创建新图像
-            new_image = QPixmap(new_width, new_height)
-            new_image.fill(self.bg_color)
-            
-            # 将原始图像绘制到新画布上
-            painter = QPainter(new_image)
-            painter.drawPixmap(0, 0, self.original_image)
-            painter.end()
-            
-            self.image = new_image
+            # 基于原始图像创建新尺寸的图像（完整保留的图块直接共享）
+            self.image = self.original_image.resized(new_width, new_height, self.bg_color)
             # 调整画布组件尺寸以匹配新图像大小（保持当前缩放）
             self._apply_zoom()
             self.mark_content_modified()
@@ -3064,62 +3597,37 @@ class PaintCanvas(QWidget):
         
         # 处理任意形状选区拖动（独立于 self.drawing 状态，任何工具下都可以拖动）
         if self.crop_selection_dragging and (event.buttons() & (Qt.LeftButton | Qt.RightButton)):
-            # 拖动已激活的选区
+            # 拖动已激活的选区（重绘移动前后两个位置）
+            old_rect = self._crop_selection_bounds()
             delta = event.pos() - self.selection_start_pos
             self.crop_selection_offset += delta
             self.selection_start_pos = event.pos()
-            self.update()
+            self._update_image_rect(self._padded_rect(old_rect.united(self._crop_selection_bounds()), 1))
             return
         
         # 处理矩形选区移动（独立于绘图状态，任何工具下都可以拖动）
         if self.selection_active and self.selection_transform_mode == "move" and (event.buttons() & (Qt.LeftButton | Qt.RightButton)):
-            # 移动矩形选区
+            # 移动矩形选区（重绘移动前后两个位置）
+            old_rect = self._selection_bounds()
             delta = event.pos() - self.selection_start_pos
             self.selection_rect.translate(delta)
             self.selection_start_pos = event.pos()
-            self.update()
+            self._update_image_rect(self._padded_rect(old_rect.united(self._selection_bounds()), 1))
             return
         
         # 原有的绘图逻辑 - 支持左右键
         if self.drawing and (event.buttons() & (Qt.LeftButton | Qt.RightButton)):
             
-            if self.current_tool == "pencil":
-                # 铅笔工具 - 自由绘制
-                painter = QPainter(self.image)
-                # 根据最后使用的鼠标按钮确定颜色
-                draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
-                painter.setPen(QPen(draw_color, self.pen_width,
-                                   self.pen_style, Qt.RoundCap, Qt.RoundJoin))
-                painter.drawLine(self.last_point, event.pos())
-                painter.end()
-                self.last_point = event.pos()
-                self.update()
-                self.mark_content_modified()
-                
-            elif self.current_tool == "brush":
-                # 刷子工具 - 粗笔刷
-                painter = QPainter(self.image)
-                # 根据最后使用的鼠标按钮确定颜色
-                draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
-                painter.setPen(QPen(draw_color, self.pen_width * 3,
-                                   self.pen_style, Qt.RoundCap, Qt.RoundJoin))
-                painter.drawLine(self.last_point, event.pos())
-                painter.end()
-                self.last_point = event.pos()
-                self.update()
-                self.mark_content_modified()
+            if self.current_tool in ["pencil", "brush"]:
+                # 铅笔/刷子工具 - 先把点加入队列，每帧合并成一条折线绘制
+                self.queue_stroke_point(event.pos())
                 
             elif self.current_tool == "eraser":
                 # 橡皮擦工具 - 改进功能
-                # 获取当前位置的颜色
-                image = self.image.toImage()
-                
                 # 根据最后使用的鼠标按钮确定擦除模式
                 if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton:
                     # 左键：保持原来的线条擦除效果，但只擦除非背景色
-                    painter = QPainter(self.image)
-                    painter.setPen(QPen(self.bg_color, self.pen_width * 4,
-                                       self.pen_style, Qt.RoundCap, Qt.RoundJoin))
+                    erase_rect = QRect()
                     
                     # 使用较小的步长进行采样，实现更精确的擦除
                     step = max(1, self.pen_width // 2)  # 根据笔宽调整采样密度
@@ -3129,61 +3637,43 @@ class PaintCanvas(QWidget):
                     
                     if distance > 0:
                         steps = max(1, int(distance / step))
-                        for i in range(steps + 1):
-                            t = i / steps
-                            x = int(self.last_point.x() + t * dx)
-                            y = int(self.last_point.y() + t * dy)
-                            
-                            if 0 <= x < self.image.width() and 0 <= y < self.image.height():
-                                current_color = image.pixelColor(x, y)
-                                # 如果当前颜色不是背景色，则擦除
-                                if current_color != self.bg_color:
-                                    painter.drawPoint(x, y)
-                    
-                    painter.end()
+                        t = np.arange(steps + 1) / steps
+                        xs = np.trunc(self.last_point.x() + t * dx).astype(int)
+                        ys = np.trunc(self.last_point.y() + t * dy).astype(int)
+                        inside = (xs >= 0) & (xs < self.image.width()) & (ys >= 0) & (ys < self.image.height())
+                        # 一次取出所有采样点的颜色，只在不是背景色的点上盖圆点
+                        erase_rect = erase_dots(self.image, xs[inside], ys[inside],
+                                                self.pen_width * 4, self.bg_color)
                 else:
                     # 右键：像素级精确替换前景色
                     # 计算擦除区域（圆形区域）
                     radius = self.pen_width * 2
                     center_x = event.pos().x()
                     center_y = event.pos().y()
-                    
-                    for dx in range(-radius, radius + 1):
-                        for dy in range(-radius, radius + 1):
-                            if dx*dx + dy*dy <= radius*radius:  # 圆形区域
-                                x = center_x + dx
-                                y = center_y + dy
-                                if 0 <= x < self.image.width() and 0 <= y < self.image.height():
-                                    current_color = image.pixelColor(x, y)
-                                    # 如果当前颜色是前景色，则用背景色替换
-                                    if current_color == self.pen_color:
-                                        image.setPixelColor(x, y, self.bg_color)
-                    
-                    # 将修改后的图像设置回去
-                    self.image = QPixmap.fromImage(image)
+                    # 只读写笔刷覆盖的图块像素，圆形掩码按半径缓存
+                    erase_rect = QRect(center_x - radius, center_y - radius, radius * 2 + 1, radius * 2 + 1)
+                    replace_color_masked(self.image, erase_rect, circle_mask(radius),
+                                         self.pen_color, self.bg_color)
                 
                 self.last_point = event.pos()
-                self.update()
+                self._update_image_rect(erase_rect)
                 self.mark_content_modified()
             
             elif self.current_tool == "airbrush":
-                # 喷枪工具 - 更新喷射位置并使用相应颜色
+                # 喷枪工具 - 更新喷射位置（颜色在按下时已确定）
                 self.current_spray_pos = event.pos()
-                # 根据最后使用的鼠标按钮确定颜色
-                draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
-                # 保存当前颜色并设置喷枪颜色
-                original_color = self.pen_color
-                self.pen_color = draw_color
                 self.spray_paint()
-                self.pen_color = original_color  # 恢复原始颜色
                 
             elif self.current_tool == "select":
                 # 矩形选取工具处理 - 支持左右键
+                old_rect = QRect(self.selection_rect)
                 if self.selection_transform_mode == "resize" and (event.buttons() & (Qt.LeftButton | Qt.RightButton)):
                     # 调整选区大小
                     self.selection_rect.setBottomRight(event.pos())
                 # 移动模式已经在前面统一处理
-                self.update()
+                # 重绘新旧两个选框覆盖的区域
+                self._update_image_rect(self._padded_rect(
+                    old_rect.normalized().united(self.selection_rect.normalized()), 1))
                 
             elif self.current_tool == "crop":
                 # 任意形状选择工具处理
@@ -3196,51 +3686,63 @@ class PaintCanvas(QWidget):
                         if (abs(event.pos().x() - last_point.x()) > 3 or 
                             abs(event.pos().y() - last_point.y()) > 3):
                             self.crop_points.append(event.pos())
-                self.update()
+                            self._simplify_crop_points()
+                            # 重绘新增的边以及到起点的连线
+                            self._update_image_rect(self._points_rect(
+                                [last_point, event.pos(), self.last_point], 1))
             
             elif self.current_tool == "polygon":
-                # 多边形绘制工具 - 记录鼠标位置并触发重绘
+                # 多边形绘制工具 - 记录鼠标位置并重绘预览线覆盖的区域
+                points = [event.pos(), self._last_mouse_pos]
+                if self.polygon_points:
+                    points += [self.polygon_points[0], self.polygon_points[-1]]
                 self._last_mouse_pos = event.pos()
-                self.update()
+                self._update_image_rect(self._points_rect(points, self.pen_width))
             
             elif self.current_tool == "curve":
-                # 曲线绘制工具 - 记录鼠标位置并触发重绘
+                # 曲线绘制工具 - 记录鼠标位置并重绘预览覆盖的区域
+                points = self.curve_points[-3:] + [event.pos(), self._last_mouse_pos]
                 self._last_mouse_pos = event.pos()
-                self.update()
+                bounds = self._points_rect(points)
+                # 样条曲线可能越过控制点范围，按范围的一半额外外扩
+                self._update_image_rect(self._padded_rect(
+                    bounds, max(bounds.width(), bounds.height()) // 2 + self.pen_width))
                 
             elif self.current_tool in ["line", "rectangle", "ellipse", "rounded"]:
-                # 形状工具 - 显示预览
-                self.image = self.temp_image.copy()
-                painter = QPainter(self.image)
-                # 根据最后使用的鼠标按钮确定颜色
-                draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
-                painter.setPen(QPen(draw_color, self.pen_width,
-                                   self.pen_style, Qt.RoundCap, Qt.RoundJoin))
-                self.draw_shape(painter, self.start_point, event.pos())
-                painter.end()
-                self.update()
+                # 形状工具 - 只记录预览终点，预览在 paintEvent 的覆盖层中绘制
+                self._shape_preview_end = event.pos()
+                shape_rect = self._padded_rect(QRect(self.start_point, event.pos()), self.pen_width)
+                # 重绘上一次预览和本次预览覆盖的区域
+                self._update_image_rect(shape_rect.united(self._last_shape_rect))
+                self._last_shape_rect = shape_rect
             
     def mouseReleaseEvent(self, event):
+        # 后台操作执行期间锁定画布输入（按下时开始的填充已转入后台，这里只结束按下状态）
+        if self.operation_worker is not None:
+            self.drawing = False
+            return
+        
         # 坐标转换：widget 坐标 → 图像坐标
         _img_pos = self._widget_to_image(event.pos())
         event.pos = lambda: _img_pos
 
+        # 画完铅笔/刷子队列中剩余的点
+        self.flush_stroke()
+        self._stroke_smooth_pos = None
+
+        # 完成形状绘制（左右键都可以画形状），只在这里把形状光栅化到文档
+        if (event.button() in [Qt.LeftButton, Qt.RightButton] and self.resizing_mode is None
+                and self.drawing and self.current_tool in ["line", "rectangle", "ellipse", "rounded"]):
+            self.finish_shape(event.pos())
+            if event.button() == Qt.RightButton:
+                self.drawing = False
+
         if event.button() == Qt.LeftButton:
             # 结束画布调整大小
             if self.resizing_mode is not None:
                 self.resizing_mode = None
                 self.original_image = None
                 return
-            if self.drawing and self.current_tool in ["line", "rectangle", "ellipse", "rounded"]:
-                # 完成形状绘制
-                painter = QPainter(self.image)
-                # 根据最后使用的鼠标按钮确定颜色
-                draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
-                painter.setPen(QPen(draw_color, self.pen_width,
-                                   self.pen_style, Qt.RoundCap, Qt.RoundJoin))
-                self.draw_shape(painter, self.start_point, event.pos())
-                self.update()
-                self.mark_content_modified()
             
             # 停止喷枪
             if self.current_tool == "airbrush":
@@ -3248,13 +3750,13 @@ class PaintCanvas(QWidget):
             
             # 文字工具完成输入
             if self.current_tool == "text" and self.is_text_mode and self.text_content:
-                painter = QPainter(self.image)
+                painter = self.image.begin_paint(self._text_rect(self.text_font, self.text_start_point, self.text_content))
                 # 文字颜色已经在mousePressEvent中设置
                 painter.setPen(QPen(self.pen_color, 1))
                 painter.setFont(self.text_font)
                 painter.drawText(self.text_start_point, self.text_content)
-                painter.end()
-                self.update()
+                self.image.end_paint(painter)
+                self.request_repaint()
                 self.mark_content_modified()
             
             # 完成矩形选取
@@ -3267,30 +3769,36 @@ class PaintCanvas(QWidget):
                     # 移动模式，不需要额外处理，位置已经更新
                     pass
                 self.selection_transform_mode = None
-                self.update()
+                self.request_repaint()
             
             # 完成矩形选区移动（任何工具下都可以结束移动）
             if self.selection_active and self.selection_transform_mode == "move":
                 self.selection_transform_mode = None
-                self.update()
+                self.request_repaint()
             
             # 完成任意形状选择（任何工具下都可以结束拖动）
             if self.crop_selection_dragging:
                 # 结束拖动选区
                 self.crop_selection_dragging = False
-                self.update()
+                self.request_repaint()
             elif self.current_tool == "crop":
                 # 只有在crop工具下才处理绘制完成
                 if self.crop_drawing:
                     # 完成多边形选区绘制
                     self.crop_drawing = False
+                    self._simplify_crop_points(final=True)
                     if len(self.crop_points) >= 3:
                         # 捕获选区内容（而非执行裁剪）
                         self.capture_crop_selection_content()
+                    elif self._crop_combine_base is not None:
+                        # 点太少，恢复参与组合的原选区
+                        self.capture_mask_selection(self._crop_combine_base)
+                        self._crop_combine = None
+                        self._crop_combine_base = None
                     else:
                         # 点太少，清除绘制
                         self.crop_points = []
-                self.update()
+                self.request_repaint()
             
             # 完成多边形绘制
             if self.current_tool == "polygon":
@@ -3316,13 +3824,8 @@ class PaintCanvas(QWidget):
             
             self.save_state()  # 操作前保存状态
             
-            # 绘制文字到画布 - 修复位置对齐问题
-            painter = QPainter(self.image)
-            painter.setPen(QPen(self.pen_color, 1))
-            painter.setFont(current_font)
-            
             # 获取字体度量信息，用于精确位置计算
-            font_metrics = painter.fontMetrics()
+            font_metrics = QFontMetrics(current_font)
             
             # 计算正确的绘制位置
             # QLineEdit的文字显示位置 vs drawText的基线位置需要精确对齐
@@ -3346,10 +3849,15 @@ class PaintCanvas(QWidget):
                 self.text_start_point.y() + border_width + padding + ascent
             )
             
+            # 绘制文字到画布 - 修复位置对齐问题（只绘制文字覆盖的图块）
+            painter = self.image.begin_paint(self._text_rect(current_font, draw_pos, text))
+            painter.setPen(QPen(self.pen_color, 1))
+            painter.setFont(current_font)
+            
             # 使用更精确的文本绘制
             painter.drawText(draw_pos, text)
-            painter.end()
-            self.update()
+            self.image.end_paint(painter)
+            self.request_repaint()
             self.mark_content_modified()
         
         # 清理输入框
@@ -3425,41 +3933,130 @@ class PaintCanvas(QWidget):
             self.text_input_widget.repaint()
             
             # 确保父画布也更新
+            self.request_repaint()
+    
+    def _frame_interval(self):
+        """屏幕一帧的时长（毫秒）"""
+        screen = self.screen() if self.isVisible() else QApplication.primaryScreen()
+        rate = screen.refreshRate() if screen is not None else 60
+        return max(1, int(1000 / (rate if rate > 0 else 60)))
+    
+    # ── 重绘调度 ──────────────────────────────────────────────────
+    def request_repaint(self, rect=None):
+        """请求重绘widget坐标中的rect（None表示整个画布），实际重绘每帧最多一次"""
+        if rect is None:
+            self._repaint_all = True
+        elif not rect.isEmpty():
+            self._repaint_region = self._repaint_region.united(rect)
+        self._schedule_frame()
+    
+    def _schedule_frame(self):
+        """排定下一帧；已经排定时只合并请求"""
+        if self._in_frame:
+            return  # 正在刷新的这一帧会一并处理
+        if self._frame_timer.isActive():
+            self.frame_stats["coalesced"] += 1
+            return
+        now = time.monotonic()
+        self._frame_due = max(now, self._last_frame_time + self._frame_interval() / 1000)
+        self._frame_timer.start(int(round((self._frame_due - now) * 1000)))
+    
+    def _flush_frame(self):
+        """刷新一帧：画完排队的笔画、推送状态，再一次性重绘累积的脏区域"""
+        now = time.monotonic()
+        interval = self._frame_interval() / 1000
+        late = now - self._frame_due
+        if late > interval:
+            self.frame_stats["dropped"] += int(late / interval)
+        self._last_frame_time = now
+        self.frame_stats["frames"] += 1
+        
+        self._in_frame = True
+        try:
+            self.flush_stroke()
+            if self._zoom_status_dirty:
+                self._zoom_status_dirty = False
+                self._show_zoom_status()
+            if self.report_frame_stats and now - self._stats_reported >= 1.0:
+                self._stats_reported = now
+                self.frame_stats_updated.emit(dict(self.frame_stats))
+        finally:
+            self._in_frame = False
+        
+        if self._repaint_all:
             self.update()
+        elif not self._repaint_region.isEmpty():
+            self.update(self._repaint_region)
+        self._repaint_all = False
+        self._repaint_region = QRegion()
+    
+    def queue_stroke_point(self, pos):
+        """记录铅笔/刷子的一个输入点，在下一帧统一绘制"""
+        point = QPointF(pos)
+        if self.stroke_smoothing > 0:
+            # 指数平滑：新位置只向输入点移动一部分，抑制手抖和高采样率下的锯齿
+            if self._stroke_smooth_pos is None:
+                self._stroke_smooth_pos = QPointF(self.last_point)
+            self._stroke_smooth_pos += (point - self._stroke_smooth_pos) * (1 - self.stroke_smoothing)
+            point = QPointF(self._stroke_smooth_pos)
+        self._stroke_queue.append(point)
+        self._schedule_frame()
+    
+    def flush_stroke(self):
+        """把队列中的点作为一条折线画到文档上（每帧最多调用一次绘制）"""
+        if not self._stroke_queue:
+            return
+        points = [QPointF(self.last_point)] + self._stroke_queue
+        self._stroke_queue = []
+        width = self.pen_width * 3 if self.current_tool == "brush" else self.pen_width
+        # 根据最后使用的鼠标按钮确定颜色
+        draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
+        polyline = QPolygonF(points)
+        dirty_rect = self._padded_rect(polyline.boundingRect().toAlignedRect(), width / 2)
+        painter = self.image.begin_paint(dirty_rect)
+        painter.setPen(QPen(draw_color, width, self.pen_style, Qt.RoundCap, Qt.RoundJoin))
+        painter.drawPolyline(polyline)
+        self.image.end_paint(painter)
+        self.last_point = points[-1].toPoint()
+        self._update_image_rect(dirty_rect)
+        self.mark_content_modified()
     
     def spray_paint(self):
-        """喷枪效果 - 在当前位置随机喷洒颜色点"""
+        """喷枪效果 - 在当前位置的圆盘内批量随机喷洒颜色点"""
         if not self.drawing:
             return
         
-        painter = QPainter(self.image)
-        painter.setPen(QPen(self.pen_color, 1, Qt.SolidLine))
+        # 喷洒点数只取决于经过的时间，定时器变慢或鼠标事件变多都不影响浓度
+        now = time.monotonic()
+        wanted = self.airbrush_flow * min(now - self._spray_time, 1.0) + self._spray_carry
+        self._spray_time = now
+        num_dots = int(wanted)
+        self._spray_carry = wanted - num_dots
+        if num_dots == 0:
+            return
         
         # 喷洒半径
         spray_radius = self.pen_width * 8
-        # 每次喷洒的点数
-        num_dots = 15
         
-        for _ in range(num_dots):
-            # 在喷洒半径内随机生成点
-            angle = random.uniform(0, 2 * 3.14159)
-            distance = random.uniform(0, spray_radius)
-            
-            x = int(self.current_spray_pos.x() + distance * random.uniform(-1, 1))
-            y = int(self.current_spray_pos.y() + distance * random.uniform(-1, 1))
-            
-            # 确保点在画布范围内
-            if 0 <= x < self.image.width() and 0 <= y < self.image.height():
-                painter.drawPoint(x, y)
-        
-        painter.end()
-        self.update()
+        # 在圆盘内均匀生成所有点
+        xs, ys = disc_points(self._spray_rng, self.current_spray_pos.x(), self.current_spray_pos.y(),
+                             spray_radius, num_dots)
+        # 确保点在画布范围内
+        inside = (xs >= 0) & (xs < self.image.width()) & (ys >= 0) & (ys < self.image.height())
+        
+        # 只绘制、重绘喷洒范围覆盖的区域
+        spray_rect = self._padded_rect(QRect(self.current_spray_pos, self.current_spray_pos), spray_radius)
+        painter = self.image.begin_paint(spray_rect)
+        painter.setPen(QPen(self.spray_color, 1, Qt.SolidLine))
+        painter.drawPoints(QPolygon([QPoint(x, y) for x, y in zip(xs[inside].tolist(), ys[inside].tolist())]))
+        self.image.end_paint(painter)
+        self._update_image_rect(spray_rect)
         self.mark_content_modified()
             
     def clear_canvas(self):
         self.save_state()  # 操作前保存状态
         self.image.fill(Qt.white)
-        self.update()
+        self.request_repaint()
         self.mark_content_modified()
         
     def set_pen_color(self, color):
@@ -3469,13 +4066,15 @@ class PaintCanvas(QWidget):
         self.bg_color = color
     
     def set_tool(self, tool):
-        # 切换工具时提交当前矩形选区（如果有）
-        if self.selection_active:
-            self.commit_selection()
+        # 切换工具前画完铅笔/刷子队列中剩余的点
+        self.flush_stroke()
         
-        # 切换工具时提交任意形状选区（如果有）
-        if self.crop_selection_active:
-            self.commit_crop_selection()
+        # 切换工具时提交当前选区（如果有），填充工具保留选区以便只填充选区内容
+        if tool != "fill":
+            if self.selection_active:
+                self.commit_selection()
+            if self.crop_selection_active:
+                self.commit_crop_selection()
         
         # 切换工具时完成当前多边形绘制（如果有）
         if self.polygon_drawing:
@@ -3492,7 +4091,7 @@ class PaintCanvas(QWidget):
         self.current_tool = tool
 
         # 设置鼠标光标形状
-        if tool == "magnifier":
+        if tool in ("magnifier", "wand"):
             self.setCursor(Qt.CrossCursor)
         else:
             self.unsetCursor()
@@ -3530,6 +4129,21 @@ class PaintCanvas(QWidget):
         """
         self.polygon_fill_mode = mode
     
+    def finish_shape(self, end):
+        """把形状光栅化到文档（预览期间只画在覆盖层上）"""
+        shape_rect = self._padded_rect(QRect(self.start_point, end), self.pen_width)
+        painter = self.image.begin_paint(shape_rect)
+        # 根据最后使用的鼠标按钮确定颜色
+        draw_color = self.pen_color if getattr(self, 'last_button', Qt.LeftButton) == Qt.LeftButton else self.bg_color
+        painter.setPen(QPen(draw_color, self.pen_width,
+                           self.pen_style, Qt.RoundCap, Qt.RoundJoin))
+        self.draw_shape(painter, self.start_point, end)
+        self.image.end_paint(painter)
+        self._update_image_rect(shape_rect.united(self._last_shape_rect))
+        self._last_shape_rect = QRect()
+        self._shape_preview_end = None
+        self.mark_content_modified()
+
     def draw_shape(self, painter, start, end):
         """绘制各种形状"""
         if self.current_tool == "line":
@@ -3576,63 +4190,69 @@ class PaintCanvas(QWidget):
         painter.setBrush(original_brush)
     
     def flood_fill(self, pos):
-        """填充工具 - 简单的颜色填充"""
-        if not self.image.rect().contains(pos):
+        """填充工具 - 按容差填充与点击处颜色相近的连通区域，替换模式下替换整幅图中的该颜色
+
+        在浮动选区内点击时只填充选区的内容；在选区外点击时先提交选区，再填充画布。
+        """
+        if self.fill_selection_content(pos):
             return
+        if self.selection_active:
+            self.commit_selection()
+        if self.crop_selection_active:
+            self.commit_crop_selection()
         
-        image = self.image.toImage()
+        if not self.image.rect().contains(pos):
+            return
         
         # 获取目标颜色
-        target_color = image.pixelColor(pos.x(), pos.y())
+        target_color = self.image.pixelColor(pos.x(), pos.y())
         
-        # 如果目标颜色和填充颜色相同，不需要填充
-        if target_color == self.pen_color:
+        # 如果目标颜色和填充颜色相同（且不允许容差），不需要填充
+        if target_color == self.pen_color and self.fill_tolerance == 0:
             return
         
-        # 简单的区域填充
-        self.fill_area_safe(image, pos, target_color)
-        self.image = QPixmap.fromImage(image)
-        self.update()
-        self.mark_content_modified()
+        # 参数在开始时取定：调用方会临时替换 pen_color，后台执行时它已恢复
+        x, y, color = pos.x(), pos.y(), QColor(self.pen_color)
+        tolerance, mode, connectivity = self.fill_tolerance, self.fill_mode, self.fill_connectivity
+        self.run_operation(
+            "填充",
+            lambda tiled, progress: flood_fill_tiled(tiled, x, y, color, tolerance, mode, connectivity, progress),
+            self._fill_finished)
     
-    def fill_area_safe(self, image, pos, target_color):
-        """安全的填充区域（使用栈避免递归）"""
-        width = image.width()
-        height = image.height()
-        
-        # 使用栈避免递归深度问题
-        stack = [pos]
-        visited = set()
+    def fill_selection_content(self, pos):
+        """在浮动选区的内容上执行填充：只修改选区的原始像素，任意形状选区只填充掩码内的像素
+
+        pos 不在浮动选区的内容上时返回False。
+        """
+        floating = self._floating_selection()
+        if floating is None:
+            return False
+        content, transform, origin, mask = floating
+        local = self._floating_pixel(pos, content, transform, origin)
+        if local is None or not mask.contains(mask.rect.topLeft() + local):
+            return False
         
-        while stack and len(visited) < 50000:  # 限制填充像素数
-            current = stack.pop()
-            x, y = current.x(), current.y()
-            
-            if (x, y) in visited:
-                continue
-            if x < 0 or x >= width or y < 0 or y >= height:
-                continue
-                
-            pixel_color = image.pixelColor(x, y)
-            if pixel_color != target_color:
-                continue
-            
-            visited.add((x, y))
-            image.setPixelColor(x, y, self.pen_color)
-            
-            # 添加四个方向的邻居
-            stack.append(QPoint(x + 1, y))
-            stack.append(QPoint(x - 1, y))
-            stack.append(QPoint(x, y + 1))
-            stack.append(QPoint(x, y - 1))
+        image = filled_image(content.toImage(), local.x(), local.y(), self.pen_color,
+                             self.fill_tolerance, self.fill_mode, self.fill_connectivity, mask.selected())
+        if image is not None:
+            self._set_floating_selection(QPixmap.fromImage(image), transform)
+            self.request_repaint()
+            self.mark_content_modified()
+        return True
+    
+    def _fill_finished(self, filled_rect):
+        """填充的收尾：只重绘被填充的区域"""
+        if filled_rect is None:
+            return
+        self._update_image_rect(filled_rect)
+        self.mark_content_modified()
     
     def pick_color(self, pos):
         """取色器工具 - 获取点击位置的颜色"""
         if not self.image.rect().contains(pos):
             return
         
-        image = self.image.toImage()
-        color = image.pixelColor(pos.x(), pos.y())
+        color = self.image.pixelColor(pos.x(), pos.y())
         
         # 通知主窗口更新颜色
         try:
@@ -3647,6 +4267,12 @@ class PaintCanvas(QWidget):
             pass
     
     def keyPressEvent(self, event):
+        # 后台操作执行期间锁定输入，Esc取消操作
+        if self.operation_worker is not None:
+            if event.key() == Qt.Key_Escape:
+                self.cancel_operation()
+            return
+        
         # 多边形工具的键盘支持
         if self.current_tool == "polygon" and self.polygon_drawing:
             if event.key() == Qt.Key_Escape:
@@ -3664,343 +4290,100 @@ class PaintCanvas(QWidget):
             if event.key() == Qt.Key_Return or event.key() == Qt.Key_Enter:
                 # 回车键完成输入
                 if self.text_content:
-                    painter = QPainter(self.image)
+                    painter = self.image.begin_paint(self._text_rect(self.text_font, self.text_start_point, self.text_content))
                     painter.setPen(QPen(self.pen_color, 1))
                     painter.setFont(self.text_font)
                     painter.drawText(self.text_start_point, self.text_content)
-                    painter.end()
-                    self.update()
+                    self.image.end_paint(painter)
+                    self.request_repaint()
                 self.is_text_mode = False
                 self.text_content = ""
             elif event.key() == Qt.Key_Backspace:
                 # 退格键删除字符
                 self.text_content = self.text_content[:-1]
-                self.update()
+                self.request_repaint()
             elif event.key() == Qt.Key_Escape:
                 # ESC键取消输入
                 self.is_text_mode = False
                 self.text_content = ""
-                self.update()
+                self.request_repaint()
             else:
                 # 添加字符
                 self.text_content += event.text()
-                self.update()
+                self.request_repaint()
         else:
             super().keyPressEvent(event)
     
-    def flip_image(self, direction):
-        """翻转图像或选区"""
-        self.save_state()  # 操作前保存状态
-        # 如果有活动的选区，只对选区内容进行翻转
-        if self.selection_active and self.selection_content is not None:
-            transform = QTransform()
-            
-            if direction == "horizontal":
-                transform.scale(-1, 1)
-                transform.translate(-self.selection_content.width(), 0)
-            elif direction == "vertical":
-                transform.scale(1, -1)
-                transform.translate(0, -self.selection_content.height())
-            
-            # 翻转选区内容
-            self.selection_content = self.selection_content.transformed(transform)
-        elif self.crop_selection_active and self.crop_selection_content is not None:
-            transform = QTransform()
-            
-            if direction == "horizontal":
-                transform.scale(-1, 1)
-                transform.translate(-self.crop_selection_content.width(), 0)
-            elif direction == "vertical":
-                transform.scale(1, -1)
-                transform.translate(0, -self.crop_selection_content.height())
-            
-            # 翻转任意形状选区内容
-            self.crop_selection_content = self.crop_selection_content.transformed(transform)
-        else:
-            # 没有选区，翻转整个图像
-            transform = QTransform()
-
-            if direction == "horizontal":
-                transform.scale(-1, 1)
-                transform.translate(-self.image.width(), 0)
-            elif direction == "vertical":
-                transform.scale(1, -1)
-                transform.translate(0, -self.image.height())
+    def _transform_content(self, title, operation, transform=None, in_place=None):
+        """对浮动选区（矩形或任意形状）的内容或整幅图像执行一次图像运算
 
-            self.image = self.image.transformed(transform)
+        operation(image, background, progress=None) 返回新的QImage：选区时background为透明，
+        整幅图像时为背景色。transform 是与operation等价的几何变换：浮动选区只把它
+        累加到选区的变换上，原始像素和掩码都不变，提交时才重采样一次；transform 为None
+        （反色等逐像素运算）时operation直接作用在选区的原始像素上。
+        in_place(tiled, progress) 不为None时整幅图像改为直接在图块上运算，不拼出整幅图像。
+        整幅图像的运算经 run_operation() 执行，大文档在后台进行，title 是显示的操作名称。
+        """
+        floating = self._floating_selection()
+        if floating is None:
+            if in_place is None:
+                background = QColor(self.bg_color)
+                in_place = lambda tiled, progress: tiled.assign(operation(tiled.toImage(), background, progress))
+            self.run_operation(title, in_place, self._content_changed)
+            return
         
-        self.update()
+        content, current = floating[:2]
+        if transform is None:
+            content = QPixmap.fromImage(operation(content.toImage(), Qt.transparent))
+        else:
+            current = current * transform
+        self._set_floating_selection(content, current)
+        self.request_repaint()
         self.mark_content_modified()
     
+    def flip_image(self, direction):
+        """翻转图像或选区"""
+        self.save_state()  # 操作前保存状态
+        self._transform_content("翻转", lambda image, background, progress=None: flipped_image(image, direction),
+                                flip_transform(direction),
+                                in_place=lambda tiled, progress: orient_tiled(tiled, direction, progress))
+    
     def rotate_image(self, angle):
-        """旋转图像或选区"""
+        """旋转图像或选区，90度的整数倍无损重排像素"""
         self.save_state()  # 操作前保存状态
-        # 如果有活动的选区，只对选区内容进行旋转
-        if self.selection_active and self.selection_content is not None:
-            # 创建变换矩阵
-            transform = QTransform()
-
-            # 获取选区内容矩形
-            original_rect = self.selection_content.rect()
-
-            # 先旋转
-            transform.rotate(angle)
-            rotated_rect = transform.mapRect(original_rect)
-
-            # 创建新图像，使用透明背景填充
-            new_image = QPixmap(rotated_rect.width(), rotated_rect.height())
-            new_image.fill(Qt.transparent)
-
-            # 绘制旋转后的选区内容
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-
-            # 重新创建变换，确保内容居中
-            transform2 = QTransform()
-            # 平移到新画布中心
-            transform2.translate(rotated_rect.width() / 2, rotated_rect.height() / 2)
-            # 旋转
-            transform2.rotate(angle)
-            # 平移到内容中心
-            transform2.translate(-original_rect.width() / 2, -original_rect.height() / 2)
-
-            painter.setTransform(transform2)
-            painter.drawPixmap(0, 0, self.selection_content)
-            painter.end()
-
-            self.selection_content = new_image
-            # 调整选区矩形大小以适应旋转后的内容
-            self.selection_rect.setSize(rotated_rect.size())
-            
-        elif self.crop_selection_active and self.crop_selection_content is not None:
-            # 旋转任意形状选区内容
-            transform = QTransform()
-
-            original_rect = self.crop_selection_content.rect()
-            transform.rotate(angle)
-            rotated_rect = transform.mapRect(original_rect)
-
-            new_image = QPixmap(rotated_rect.width(), rotated_rect.height())
-            new_image.fill(Qt.transparent)
-
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-
-            transform2 = QTransform()
-            transform2.translate(rotated_rect.width() / 2, rotated_rect.height() / 2)
-            transform2.rotate(angle)
-            transform2.translate(-original_rect.width() / 2, -original_rect.height() / 2)
-
-            painter.setTransform(transform2)
-            painter.drawPixmap(0, 0, self.crop_selection_content)
-            painter.end()
-
-            self.crop_selection_content = new_image
-            self.crop_selection_rect.setSize(rotated_rect.size())
-            
-        else:
-            # 没有选区，旋转整个图像
-            # 创建变换矩阵
-            transform = QTransform()
-            
-            # 计算新图像尺寸
-            original_rect = self.image.rect()
-            
-            # 先旋转
-            transform.rotate(angle)
-            rotated_rect = transform.mapRect(original_rect)
-            
-            # 创建新图像，使用当前背景色填充
-            new_image = QPixmap(rotated_rect.width(), rotated_rect.height())
-            new_image.fill(self.bg_color)
-            
-            # 绘制旋转后的图像
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-            
-            # 重新创建变换，确保图像居中
-            transform2 = QTransform()
-            # 平移到新画布中心
-            transform2.translate(rotated_rect.width() / 2, rotated_rect.height() / 2)
-            # 旋转
-            transform2.rotate(angle)
-            # 平移到图像中心
-            transform2.translate(-original_rect.width() / 2, -original_rect.height() / 2)
-            
-            painter.setTransform(transform2)
-            painter.drawPixmap(0, 0, self.image)
-            painter.end()
-            
-            self.image = new_image
-            # 更新画布组件尺寸以匹配新图像大小（保持当前缩放）
-            self._apply_zoom()
-        
-        self.update()
-        self.mark_content_modified()
+        orientation = right_angle_orientation(angle)
+        self._transform_content(
+            "旋转", lambda image, background, progress=None: rotated_image(image, angle, background, progress),
+            QTransform().rotate(angle),
+            in_place=(lambda tiled, progress: orient_tiled(tiled, orientation, progress)) if orientation else None)
     
     def stretch_image(self, horizontal_percent, vertical_percent):
         """拉伸图像或选区"""
         self.save_state()  # 操作前保存状态
-        # 如果有活动的选区，只对选区内容进行拉伸
-        if self.selection_active and self.selection_content is not None:
-            new_width = int(self.selection_content.width() * horizontal_percent / 100)
-            new_height = int(self.selection_content.height() * vertical_percent / 100)
-            
-            # 拉伸选区内容
-            self.selection_content = self.selection_content.scaled(new_width, new_height,
-                                                                   Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-            # 调整选区矩形大小
-            self.selection_rect.setSize(self.selection_content.size())
-            
-        elif self.crop_selection_active and self.crop_selection_content is not None:
-            new_width = int(self.crop_selection_content.width() * horizontal_percent / 100)
-            new_height = int(self.crop_selection_content.height() * vertical_percent / 100)
-            
-            # 拉伸任意形状选区内容
-            self.crop_selection_content = self.crop_selection_content.scaled(new_width, new_height,
-                                                                               Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-            # 调整选区矩形大小
-            self.crop_selection_rect.setSize(self.crop_selection_content.size())
-            
-        else:
-            # 没有选区，拉伸整个图像
-            new_width = int(self.image.width() * horizontal_percent / 100)
-            new_height = int(self.image.height() * vertical_percent / 100)
-            
-            self.image = self.image.scaled(new_width, new_height,
-                                           Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-        
-        self.update()
-        self.mark_content_modified()
+        self._transform_content(
+            "拉伸", lambda image, background, progress=None: stretched_image(
+                image, horizontal_percent, vertical_percent, progress),
+            stretch_transform(horizontal_percent, vertical_percent))
     
     def skew_image(self, horizontal_angle, vertical_angle):
         """扭曲图像或选区"""
         self.save_state()  # 操作前保存状态
-        # 如果有活动的选区，只对选区内容进行扭曲
-        if self.selection_active and self.selection_content is not None:
-            transform = QTransform()
-            
-            # 转换为弧度
-            h_rad = horizontal_angle * 3.14159 / 180
-            v_rad = vertical_angle * 3.14159 / 180
-            
-            # 应用剪切变换
-            transform.shear(h_rad, v_rad)
-            
-            # 计算新选区内容尺寸
-            original_rect = self.selection_content.rect()
-            skewed_rect = transform.mapRect(original_rect)
-            
-            # 创建新图像，使用透明背景填充
-            new_image = QPixmap(skewed_rect.width(), skewed_rect.height())
-            new_image.fill(Qt.transparent)
-            
-            # 绘制扭曲后的选区内容
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-            painter.setTransform(transform)
-            painter.drawPixmap(0, 0, self.selection_content)
-            painter.end()
-            
-            self.selection_content = new_image
-            # 调整选区矩形大小以适应扭曲后的内容
-            self.selection_rect.setSize(skewed_rect.size())
-            
-        elif self.crop_selection_active and self.crop_selection_content is not None:
-            transform = QTransform()
-            
-            h_rad = horizontal_angle * 3.14159 / 180
-            v_rad = vertical_angle * 3.14159 / 180
-            
-            transform.shear(h_rad, v_rad)
-            
-            original_rect = self.crop_selection_content.rect()
-            skewed_rect = transform.mapRect(original_rect)
-            
-            new_image = QPixmap(skewed_rect.width(), skewed_rect.height())
-            new_image.fill(Qt.transparent)
-            
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-            painter.setTransform(transform)
-            painter.drawPixmap(0, 0, self.crop_selection_content)
-            painter.end()
-            
-            self.crop_selection_content = new_image
-            self.crop_selection_rect.setSize(skewed_rect.size())
-            
-        else:
-            # 没有选区，扭曲整个图像
-            transform = QTransform()
-            
-            # 转换为弧度
-            h_rad = horizontal_angle * 3.14159 / 180
-            v_rad = vertical_angle * 3.14159 / 180
-            
-            # 应用剪切变换
-            transform.shear(h_rad, v_rad)
-            
-            # 计算新图像尺寸
-            original_rect = self.image.rect()
-            skewed_rect = transform.mapRect(original_rect)
-            
-            # 创建新图像
-            new_image = QPixmap(skewed_rect.width(), skewed_rect.height())
-            new_image.fill(Qt.white)
-            
-            # 绘制扭曲后的图像
-            painter = QPainter(new_image)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-            painter.setTransform(transform)
-            painter.drawPixmap(0, 0, self.image)
-            painter.end()
-            
-            self.image = new_image
-        
-        self.update()
-        self.mark_content_modified()
+        self._transform_content(
+            "扭曲", lambda image, background, progress=None: skewed_image(
+                image, horizontal_angle, vertical_angle, background, progress),
+            skew_transform(horizontal_angle, vertical_angle))
 
     def invert_colors(self):
         """反色功能：如果没有选区，反色整个画布；如果有选区，只反色选区内容"""
         self.save_state()  # 操作前保存状态
-        # 检查是否有活动的矩形选区
-        if self.selection_active and self.selection_content is not None:
-            # 反色矩形选区内容
-            img = self.selection_content.toImage()
-            for x in range(img.width()):
-                for y in range(img.height()):
-                    color = img.pixelColor(x, y)
-                    inverted_color = QColor(255 - color.red(), 255 - color.green(), 255 - color.blue())
-                    img.setPixelColor(x, y, inverted_color)
-            self.selection_content = QPixmap.fromImage(img)
-            self.update()
-            self.mark_content_modified()
+        if self._floating_selection() is not None:
+            # 反色选区内容（保留透明度，任意形状选区外部分仍然透明）
+            self._transform_content("反色", lambda image, background, progress=None: inverted_image(image))
             return
         
-        # 检查是否有活动的任意形状选区
-        if self.crop_selection_active and self.crop_selection_content is not None:
-            # 反色任意形状选区内容
-            img = self.crop_selection_content.toImage()
-            for x in range(img.width()):
-                for y in range(img.height()):
-                    color = img.pixelColor(x, y)
-                    inverted_color = QColor(255 - color.red(), 255 - color.green(), 255 - color.blue())
-                    img.setPixelColor(x, y, inverted_color)
-            self.crop_selection_content = QPixmap.fromImage(img)
-            self.update()
-            self.mark_content_modified()
-            return
-        
-        # 没有选区，反色整个画布
-        img = self.image.toImage()
-        for x in range(img.width()):
-            for y in range(img.height()):
-                color = img.pixelColor(x, y)
-                inverted_color = QColor(255 - color.red(), 255 - color.green(), 255 - color.blue())
-                img.setPixelColor(x, y, inverted_color)
-        self.image = QPixmap.fromImage(img)
-        self.update()
-        self.mark_content_modified()
+        # 没有选区，逐个图块就地反色整个画布
+        self.run_operation("反色", lambda tiled, progress: tiled.apply_to_tiles(invert_image, progress),
+                           self._content_changed)
 
 
 class MSPaintWindow(QMainWindow):
@@ -4210,6 +4593,21 @@ class MSPaintWindow(QMainWindow):
         self.status_bar.setStyleSheet("background-color: #D4D0C8; color: black;")
         middle_layout.addWidget(self.status_bar)
         
+        # 后台操作的进度条和取消按钮，只在操作执行期间显示
+        self.operation_progress_bar = QProgressBar()
+        self.operation_progress_bar.setRange(0, 100)
+        self.operation_progress_bar.setMaximumWidth(160)
+        self.operation_progress_bar.hide()
+        self.status_bar.addPermanentWidget(self.operation_progress_bar)
+        self.operation_cancel_button = QPushButton("取消")
+        self.operation_cancel_button.clicked.connect(self.canvas.cancel_operation)
+        self.operation_cancel_button.hide()
+        self.status_bar.addPermanentWidget(self.operation_cancel_button)
+        self.canvas.operation_started.connect(self.on_operation_started)
+        self.canvas.operation_progress.connect(self.operation_progress_bar.setValue)
+        self.canvas.operation_stopped.connect(self.on_operation_stopped)
+        self.canvas.frame_stats_updated.connect(self.show_frame_stats)
+        
         main_layout.addWidget(middle_widget, stretch=1)
         
         # 设置窗口关闭事件处理
@@ -4220,8 +4618,31 @@ class MSPaintWindow(QMainWindow):
         self.text_toolbar_sync_timer.timeout.connect(self.sync_text_toolbar_menu_state)
         self.text_toolbar_sync_timer.start(500)  # 每500毫秒同步一次
     
+    def on_operation_started(self, title):
+        """后台操作开始：显示进度，锁定菜单和工具箱"""
+        self.status_bar.showMessage(f"正在{title}…（按Esc取消）")
+        self.operation_progress_bar.setValue(0)
+        self.operation_progress_bar.show()
+        self.operation_cancel_button.show()
+        self.menuBar().setEnabled(False)
+        self.toolbox_widget.setEnabled(False)
+        self.canvas.setFocus()
+    
+    def on_operation_stopped(self, message):
+        """后台操作结束：隐藏进度，恢复菜单和工具箱"""
+        self.operation_progress_bar.hide()
+        self.operation_cancel_button.hide()
+        self.menuBar().setEnabled(True)
+        self.toolbox_widget.setEnabled(True)
+        self.status_bar.showMessage(message, 3000)
+    
     def closeEvent(self, event):
         """窗口关闭事件处理"""
+        # 取消后台操作并等待工作线程退出
+        if self.canvas.operation_worker is not None:
+            self.canvas.cancel_operation()
+            self.canvas.operation_worker.wait()
+        
         # 先完成文字输入（如果有）
         if self.canvas.is_text_mode:
             self.canvas.finish_text_input()
@@ -4265,6 +4686,7 @@ class MSPaintWindow(QMainWindow):
             # 如果选择的是discard_button，则直接关闭
         
         # 如果没有修改或用户选择不保存，则正常关闭
+        self.canvas.history.close()  # 删除撤销历史的转存文件
         event.accept()
     
     def save_current_file(self):
@@ -4322,9 +4744,11 @@ class MSPaintWindow(QMainWindow):
         
         # 创建覆盖整个画布的选区
         self.canvas.selection_rect = QRect(0, 0, self.canvas.image.width(), self.canvas.image.height())
-        self.canvas.selection_content = self.canvas.image.copy(self.canvas.selection_rect)
+        self.canvas.selection_content = QPixmap.fromImage(self.canvas.image.copy(self.canvas.selection_rect))
+        self.canvas.selection_transform = QTransform()
+        self.canvas.selection_mask = SelectionMask.from_rect(self.canvas.selection_rect)
         self.canvas.selection_active = True
-        self.canvas.update()
+        self.canvas.request_repaint()
         self.statusBar().showMessage("已选择整个画布", 2000)
     
     def clear_selection_area(self):
@@ -4334,18 +4758,41 @@ class MSPaintWindow(QMainWindow):
             return
         
         # 清除选区内的内容（用背景色填充）
-        painter = QPainter(self.canvas.image)
+        painter = self.canvas.image.begin_paint(self.canvas.selection_rect)
         painter.setBrush(self.canvas.bg_color)
         painter.setPen(Qt.NoPen)
         painter.drawRect(self.canvas.selection_rect)
-        painter.end()
+        self.canvas.image.end_paint(painter)
         
         # 清除选区状态
         self.canvas.clear_selection()
         self.canvas.mark_content_modified()
-        self.canvas.update()
+        self.canvas.request_repaint()
         self.statusBar().showMessage("已清除选区内容", 2000)
     
+    def invert_selection(self):
+        """反选 - 选中画布上当前选区以外的部分"""
+        canvas_rect = self.canvas.image.rect()
+        if not self.canvas.modify_selection(lambda mask: mask.inverted(canvas_rect)):
+            QMessageBox.information(self, "提示", "没有活动的选区")
+    
+    def grow_selection(self):
+        """扩展选区"""
+        self._resize_selection("扩展选区", lambda mask, radius: mask.grown(radius))
+    
+    def shrink_selection(self):
+        """收缩选区"""
+        self._resize_selection("收缩选区", lambda mask, radius: mask.shrunk(radius))
+    
+    def _resize_selection(self, title, operation):
+        """询问像素数后扩展或收缩选区"""
+        if self.canvas.current_selection_mask() is None:
+            QMessageBox.information(self, "提示", "没有活动的选区")
+            return
+        radius, ok = QInputDialog.getInt(self, title, "像素数:", 1, 1, 100)
+        if ok:
+            self.canvas.modify_selection(lambda mask: operation(mask, radius))
+    
     def print_image(self):
         """打印当前图像"""
         if self.canvas.image.isNull():
@@ -4380,7 +4827,7 @@ class MSPaintWindow(QMainWindow):
                 y = (page_rect.height() - scaled_height) // 2
                 
                 # 绘制图像
-                painter.drawPixmap(x, y, scaled_width, scaled_height, self.canvas.image)
+                painter.drawImage(QRect(x, y, scaled_width, scaled_height), self.canvas.image.toImage())
                 painter.end()
                 
                 self.statusBar().showMessage("打印完成", 2000)
@@ -4430,7 +4877,7 @@ class MSPaintWindow(QMainWindow):
             y = (page_rect.height() - scaled_height) // 2
             
             # 绘制图像
-            painter.drawPixmap(x, y, scaled_width, scaled_height, self.canvas.image)
+            painter.drawImage(QRect(x, y, scaled_width, scaled_height), self.canvas.image.toImage())
             painter.end()
         except Exception as e:
             QMessageBox.critical(self, "预览错误", f"预览失败：{str(e)}")
@@ -4516,6 +4963,16 @@ class MSPaintWindow(QMainWindow):
         clear_selection_action = edit_menu.addAction("清空选区")
         clear_selection_action.triggered.connect(self.clear_selection_area)
         
+        invert_selection_action = edit_menu.addAction("反选")
+        invert_selection_action.setShortcut("Ctrl+Shift+I")
+        invert_selection_action.triggered.connect(self.invert_selection)
+        
+        grow_selection_action = edit_menu.addAction("扩展选区...")
+        grow_selection_action.triggered.connect(self.grow_selection)
+        
+        shrink_selection_action = edit_menu.addAction("收缩选区...")
+        shrink_selection_action.triggered.connect(self.shrink_selection)
+        
         clear_action = edit_menu.addAction("清空画布")
         clear_action.triggered.connect(self.canvas.clear_canvas)
         
@@ -4540,6 +4997,12 @@ class MSPaintWindow(QMainWindow):
         self.status_bar_action.setChecked(True)
         self.status_bar_action.triggered.connect(self.toggle_status_bar)
         
+        # 帧统计开关菜单项：在状态栏显示刷新帧数、合并的重绘请求数和丢帧数
+        self.frame_stats_action = view_menu.addAction("帧统计")
+        self.frame_stats_action.setCheckable(True)
+        self.frame_stats_action.setChecked(False)
+        self.frame_stats_action.triggered.connect(self.toggle_frame_stats)
+        
         # 文字工具栏开关菜单项
         self.text_toolbar_action = view_menu.addAction("文字工具栏")
         self.text_toolbar_action.setCheckable(True)
@@ -4622,6 +5085,7 @@ class MSPaintWindow(QMainWindow):
         tools = [
             ("crop", "任意形状选择", self.create_icon("crop")),
             ("select", "矩形选取", self.create_icon("select")),
+            ("wand", "魔棒", self.create_icon("wand")),
             ("eraser", "橡皮", self.create_icon("eraser")),
             ("fill", "填充", self.create_icon("fill")),
             ("eyedropper", "取色", self.create_icon("eyedropper")),
@@ -4744,11 +5208,75 @@ class MSPaintWindow(QMainWindow):
         self.mode_buttons.append(mode3_btn)
         
         toolbox_layout.addWidget(mode_widget)
+        
+        # 添加填充工具选项（颜色容差和连通方式）
+        fill_options_widget = QWidget()
+        fill_options_layout = QVBoxLayout(fill_options_widget)
+        fill_options_layout.setContentsMargins(2, 2, 2, 2)
+        fill_options_layout.setSpacing(2)
+        self.fill_options_widget = fill_options_widget  # 保存引用
+        
+        tolerance_label = QLabel("容差:")
+        tolerance_label.setStyleSheet("color: black; font-size: 9px;")
+        fill_options_layout.addWidget(tolerance_label)
+        
+        self.fill_tolerance_spin = QSpinBox()
+        self.fill_tolerance_spin.setRange(0, 255)
+        self.fill_tolerance_spin.setValue(self.canvas.fill_tolerance)
+        self.fill_tolerance_spin.setToolTip("颜色容差：与点击处颜色每个通道相差不超过该值的像素会被填充")
+        self.fill_tolerance_spin.setFixedWidth(48)
+        self.fill_tolerance_spin.valueChanged.connect(self.set_fill_tolerance)
+        fill_options_layout.addWidget(self.fill_tolerance_spin)
+        
+        self.fill_connectivity_check = QCheckBox("8连通")
+        self.fill_connectivity_check.setStyleSheet("color: black; font-size: 9px;")
+        self.fill_connectivity_check.setToolTip("勾选后沿对角方向相接的像素也会被填充")
+        self.fill_connectivity_check.toggled.connect(self.set_fill_connectivity)
+        fill_options_layout.addWidget(self.fill_connectivity_check)
+        
+        self.fill_replace_check = QCheckBox("全部替换")
+        self.fill_replace_check.setStyleSheet("color: black; font-size: 9px;")
+        self.fill_replace_check.setToolTip("勾选后替换整幅图中与点击处颜色匹配的所有像素，不要求相连")
+        self.fill_replace_check.toggled.connect(self.set_fill_replace_mode)
+        fill_options_layout.addWidget(self.fill_replace_check)
+        
+        toolbox_layout.addWidget(fill_options_widget)
+        
+        # 添加魔棒工具选项（颜色容差和是否只选相连区域）
+        wand_options_widget = QWidget()
+        wand_options_layout = QVBoxLayout(wand_options_widget)
+        wand_options_layout.setContentsMargins(2, 2, 2, 2)
+        wand_options_layout.setSpacing(2)
+        self.wand_options_widget = wand_options_widget  # 保存引用
+        
+        wand_tolerance_label = QLabel("容差:")
+        wand_tolerance_label.setStyleSheet("color: black; font-size: 9px;")
+        wand_options_layout.addWidget(wand_tolerance_label)
+        
+        self.wand_tolerance_spin = QSpinBox()
+        self.wand_tolerance_spin.setRange(0, 255)
+        self.wand_tolerance_spin.setValue(self.canvas.wand_tolerance)
+        self.wand_tolerance_spin.setToolTip("颜色容差：与点击处颜色每个通道相差不超过该值的像素会被选中")
+        self.wand_tolerance_spin.setFixedWidth(48)
+        self.wand_tolerance_spin.valueChanged.connect(self.set_wand_tolerance)
+        wand_options_layout.addWidget(self.wand_tolerance_spin)
+        
+        self.wand_contiguous_check = QCheckBox("连续")
+        self.wand_contiguous_check.setStyleSheet("color: black; font-size: 9px;")
+        self.wand_contiguous_check.setToolTip("勾选时只选择与点击处相连的区域，否则选择整幅图中所有相近颜色；"
+                                              "按住Shift添加到选区，按住Alt从选区中减去")
+        self.wand_contiguous_check.setChecked(self.canvas.wand_contiguous)
+        self.wand_contiguous_check.toggled.connect(self.set_wand_contiguous)
+        wand_options_layout.addWidget(self.wand_contiguous_check)
+        
+        toolbox_layout.addWidget(wand_options_widget)
         toolbox_layout.addStretch()
         
         # 初始隐藏填充模式选择器（默认工具是铅笔，不需要填充模式）
         mode_label.hide()
         mode_widget.hide()
+        fill_options_widget.hide()
+        wand_options_widget.hide()
         
         main_layout.addWidget(toolbox)
         return toolbox
@@ -4758,6 +5286,7 @@ class MSPaintWindow(QMainWindow):
         # 简单的Base64图标数据 - 16x16像素
         icon_data = {
             "select": "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAACXBIWXMAAAsSAAALEgHS3X78AAAAQElEQVQ4T2NgoBK4CjXnP5AGYRAghn2VBc0BjEh8YthUcj/QGJgXSDXxKhOpOmimftQLiKAlJvUhq6FZpAwlgwE4RRanfEMhnAAAAABJRU5ErkJggg==",
+            "wand": "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAACXBIWXMAAA9hAAAPYQGoP6dpAAAAUUlEQVQ4jWNgoDH4D8XoYhQbSrbG/1jYlLmAiQzbUQAjiTZiqCfkAnya/xNyAUHN+AzA62wGApJEa8amgCTN6IpI1oyskCzNDAyY0UiSZqoAACSMFQLW0EmrAAAAAElFTkSuQmCC",
             "crop": "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAACXBIWXMAAAsSAAALEgHS3X78AAAAdElEQVQ4T51Q2w2AIBA7XYf9RzFxBRN3EEkU60FJD77uUfo4s/ZdnRkdrWQzIvntGMEyQdz9gmpyNA8c9iwC2mFxIrfWsUpOitl0HWuwinLlP4893U39U4q3wRoNFUWPYdiP+WEIuQucgUPR6hQhzaayhTJnFM0iQ4vipPIAAAAASUVORK5CYII=",
             "pencil": "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAACXBIWXMAAAsSAAALEgHS3X78AAAAmklEQVQ4T6VS2w2AIAykxmlkCd3VPeTXARjDGWoLqDVBKNiEEE3vUXpgdIWiDSRkVOD9JpoWYzx92utXkQARLQBM3DxjMgEvA1V9VkNyQFyBga9bvYhOjQwLwHSYUF2ewVzOuV71YLxXPYJ/qD8PR0M3zb52z56ed4/r6pudOQ6xNhnh7PpysfrMfY5hKKSiLbOCqGpbHUVN4wnChnL5OZeo3QAAAABJRU5ErkJggg==",
             "fill": "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAACXBIWXMAAAsSAAALEgHS3X78AAAAqUlEQVQ4T71T2xGAMAhDJ6uT2yV0nQpUavCorw+58yzPJFiJfrCFMcpXnCJ2NWCEyXkvlLfY3qsH9fkRNqEZSsk56xkN/TObAQPcTCklonmOYaYJ49JLTcLLZpN0DGijDQXRPHItrSyLk8ABpaWyTEa/mYhz+BVQ36rOTbMA9hg0jW6bnpVfYrB2k4OajVXLiQRf6CfVXIB8Bry775Lv3kIb9vmHCeQ/D23ipFYrkNVMygAAAABJRU5ErkJggg==",
@@ -4829,6 +5358,27 @@ class MSPaintWindow(QMainWindow):
         if hasattr(self.canvas, 'polygon_fill_mode'):
             self.canvas.polygon_fill_mode = mode
     
+    def set_fill_tolerance(self, value):
+        """设置填充工具的颜色容差"""
+        self.canvas.fill_tolerance = value
+    
+    def set_fill_connectivity(self, checked):
+        """设置填充工具的连通方式（4连通或8连通）"""
+        self.canvas.fill_connectivity = 8 if checked else 4
+    
+    def set_fill_replace_mode(self, checked):
+        """切换填充工具的全部替换模式（替换模式下连通方式不起作用）"""
+        self.canvas.fill_mode = "replace" if checked else "flood"
+        self.fill_connectivity_check.setEnabled(not checked)
+    
+    def set_wand_tolerance(self, value):
+        """设置魔棒工具的颜色容差"""
+        self.canvas.wand_tolerance = value
+    
+    def set_wand_contiguous(self, checked):
+        """设置魔棒工具是否只选择相连区域"""
+        self.canvas.wand_contiguous = checked
+    
     def create_color_palette_and_brush(self, parent_layout):
         """创建颜色选择器和笔刷设置"""
         color_widget = QWidget()
@@ -5020,6 +5570,12 @@ class MSPaintWindow(QMainWindow):
             else:
                 self.mode_label.hide()
                 self.mode_widget.hide()
+        
+        # 填充工具显示容差和连通方式选项
+        if hasattr(self, 'fill_options_widget'):
+            self.fill_options_widget.setVisible(tool_name == "fill")
+        if hasattr(self, 'wand_options_widget'):
+            self.wand_options_widget.setVisible(tool_name == "wand")
     
     def change_fg_color(self, color_name):
         """改变前景颜色"""
@@ -5064,22 +5620,13 @@ class MSPaintWindow(QMainWindow):
     
     def resize_canvas(self, width, height):
         """调整画布大小"""
-        # 创建新图像
-        new_image = QPixmap(width, height)
-        new_image.fill(Qt.white)
-        
-        # 将原始图像绘制到新画布上（保持内容）
-        painter = QPainter(new_image)
-        painter.drawPixmap(0, 0, self.canvas.image)
-        painter.end()
-        
-        # 更新画布
-        self.canvas.image = new_image
+        # 创建新尺寸的图像，保持原内容（完整保留的图块直接共享）
+        self.canvas.image = self.canvas.image.resized(width, height, Qt.white)
         self.canvas._apply_zoom()
     
     def show_stretch_skew_dialog(self):
         """显示拉伸和扭曲对话框"""
-        dialog = StretchSkewDialog(self)
+        dialog = StretchSkewDialog(self, self.canvas.preview_proxy())
         if dialog.exec_() == QDialog.Accepted:
             horizontal_stretch = dialog.horizontal_stretch_spin.value()
             vertical_stretch = dialog.vertical_stretch_spin.value()
@@ -5095,7 +5642,7 @@ class MSPaintWindow(QMainWindow):
     
     def show_flip_rotate_dialog(self):
         """显示翻转和旋转对话框"""
-        dialog = FlipRotateDialog(self)
+        dialog = FlipRotateDialog(self, self.canvas.preview_proxy())
         if dialog.exec_() == QDialog.Accepted:
             selection = dialog.get_selection()
             
@@ -5155,9 +5702,9 @@ class MSPaintWindow(QMainWindow):
             else:
                 pixmap = QPixmap.fromImage(image)
             
-            # 调整图像大小以适应画布
+            # 调整图像大小以适应画布（大比例缩小按面积平均，不会混叠）
             canvas_size = self.canvas.size()
-            scaled_pixmap = pixmap.scaled(canvas_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            scaled_pixmap = QPixmap.fromImage(fitted_image(pixmap.toImage(), canvas_size))
             
             # 创建新图像以居中显示
             final_image = QPixmap(canvas_size)
@@ -5170,9 +5717,12 @@ class MSPaintWindow(QMainWindow):
             painter.drawPixmap(x, y, scaled_pixmap)
             painter.end()
             
-            # 应用到画布
-            self.canvas.image = final_image
-            self.canvas.update()
+            # 应用到画布：与其他整幅文档运算一样经 run_operation() 执行，
+            # 后台操作进行中时排在它之后，不会被它的结果覆盖
+            final_image = final_image.toImage()
+            self.canvas.save_state()
+            self.canvas.run_operation("应用AI图像", lambda tiled, progress: tiled.assign(final_image),
+                                      self.canvas._content_changed)
             
         except Exception as e:
             QMessageBox.critical(self, "错误", f"应用AI图像失败: {str(e)}")
@@ -5198,6 +5748,17 @@ class MSPaintWindow(QMainWindow):
         else:
             self.status_bar.hide()
     
+    def toggle_frame_stats(self):
+        """切换状态栏中的帧统计显示"""
+        self.canvas.report_frame_stats = self.frame_stats_action.isChecked()
+        if not self.canvas.report_frame_stats:
+            self.status_bar.clearMessage()
+    
+    def show_frame_stats(self, stats):
+        """在状态栏显示帧统计"""
+        self.status_bar.showMessage(
+            f"帧: {stats['frames']}  合并的重绘请求: {stats['coalesced']}  丢帧: {stats['dropped']}")
+    
     def toggle_text_toolbar(self):
         """切换文字工具栏显示/隐藏"""
         # 只有在文字工具时才允许切换，否则忽略点击
@@ -5276,8 +5837,8 @@ class MSPaintWindow(QMainWindow):
                 return
         
         # 创建新的空白画布
-        self.canvas.image = QPixmap(720, 520)  # 默认尺寸
-        self.canvas.image.fill(Qt.white)
+        self.canvas.image = TiledImage(720, 520, Qt.white)  # 默认尺寸
+        self.canvas.clear_history()
         self.canvas.reset_zoom()  # 重置缩放到100%
         
         # 重置文件路径和画布状态
@@ -5332,7 +5893,8 @@ class MSPaintWindow(QMainWindow):
                     return
                 
                 # 应用到画布
-                self.canvas.image = image
+                self.canvas.image = TiledImage.from_image(image)
+                self.canvas.clear_history()
                 self.canvas.reset_zoom()  # 重置缩放到100%
                 
                 # 更新文件路径和画布状态
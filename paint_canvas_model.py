@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+画布分块存储模型
+把整幅文档切成固定大小的QImage图块，绘图、重绘、撤销和保存只读写用到的图块
+"""
+
+import zlib
+
+from PyQt5.QtCore import Qt, QPoint, QRect, QSize
+from PyQt5.QtGui import QImage, QPainter, QPixmap, QColor
+
+# 图块边长（像素）
+TILE_SIZE = 256
+# 图块像素格式
+TILE_FORMAT = QImage.Format_ARGB32
+
+
+class TiledImage:
+    """分块画布图像
+
+    文档由 TILE_SIZE×TILE_SIZE 的QImage图块组成。
+    QImage是隐式共享的，快照只复制图块引用，被修改的图块才会真正分离。
+    revision 在每次修改后递增，可用来廉价地判断文档是否变化。
+    """
+
+    def __init__(self, width, height, fill_color=Qt.white):
+        self._width = max(int(width), 0)
+        self._height = max(int(height), 0)
+        self._cols = (self._width + TILE_SIZE - 1) // TILE_SIZE
+        self._rows = (self._height + TILE_SIZE - 1) // TILE_SIZE
+        self._tiles = {}
+        self.revision = 0  # 修改计数
+        for key in self.tile_keys():
+            rect = self.tile_rect(key)
+            tile = QImage(rect.width(), rect.height(), TILE_FORMAT)
+            tile.fill(QColor(fill_color))
+            self._tiles[key] = tile
+
+    @classmethod
+    def from_image(cls, image):
+        """由QImage或QPixmap创建分块图像"""
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        if image.format() != TILE_FORMAT:
+            image = image.convertToFormat(TILE_FORMAT)
+        tiled = cls.__new__(cls)
+        tiled._width = image.width()
+        tiled._height = image.height()
+        tiled._cols = (tiled._width + TILE_SIZE - 1) // TILE_SIZE
+        tiled._rows = (tiled._height + TILE_SIZE - 1) // TILE_SIZE
+        tiled._tiles = {}
+        tiled.revision = 0
+        for key in tiled.tile_keys():
+            tiled._tiles[key] = image.copy(tiled.tile_rect(key))
+        return tiled
+
+    # ── 与QPixmap兼容的尺寸接口 ──────────────────────────────────
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def size(self):
+        return QSize(self._width, self._height)
+
+    def rect(self):
+        return QRect(0, 0, self._width, self._height)
+
+    def isNull(self):
+        return self._width == 0 or self._height == 0
+
+    # ── 图块索引 ──────────────────────────────────────────────────
+    def tile_keys(self):
+        """按行列顺序返回全部图块坐标"""
+        return [(tx, ty) for ty in range(self._rows) for tx in range(self._cols)]
+
+    def tile_rect(self, key):
+        """图块在文档坐标中的矩形"""
+        tx, ty = key
+        x = tx * TILE_SIZE
+        y = ty * TILE_SIZE
+        return QRect(x, y, min(TILE_SIZE, self._width - x), min(TILE_SIZE, self._height - y))
+
+    def tile(self, key):
+        return self._tiles[key]
+
+    def tiles_in(self, rect):
+        """返回与矩形相交的图块坐标"""
+        rect = QRect(rect).intersected(self.rect())
+        if rect.isEmpty():
+            return []
+        tx0 = rect.left() // TILE_SIZE
+        tx1 = rect.right() // TILE_SIZE
+        ty0 = rect.top() // TILE_SIZE
+        ty1 = rect.bottom() // TILE_SIZE
+        return [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+    # ── 读取 ──────────────────────────────────────────────────────
+    def copy(self, rect=None):
+        """把指定区域（默认整幅）拼成一张QImage，区域外部分为透明"""
+        rect = self.rect() if rect is None else QRect(rect)
+        result = QImage(max(rect.width(), 0), max(rect.height(), 0), TILE_FORMAT)
+        if result.isNull():
+            return result
+        keys = self.tiles_in(rect)
+        if len(keys) == 1 and self.tile_rect(keys[0]).contains(rect):
+            # 区域落在单个图块内，直接截取
+            return self._tiles[keys[0]].copy(rect.translated(-self.tile_rect(keys[0]).topLeft()))
+        if not self.rect().contains(rect):
+            result.fill(Qt.transparent)
+        painter = QPainter(result)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for key in keys:
+            tile_rect = self.tile_rect(key)
+            part = tile_rect.intersected(rect)
+            painter.drawImage(part.topLeft() - rect.topLeft(), self._tiles[key],
+                              part.translated(-tile_rect.topLeft()))
+        painter.end()
+        return result
+
+    def toImage(self):
+        """整幅文档拼成一张QImage（保存、打印等需要完整图像时使用）"""
+        return self.copy()
+
+    def pixelColor(self, x, y):
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return QColor()
+        key = (x // TILE_SIZE, y // TILE_SIZE)
+        return self._tiles[key].pixelColor(x - key[0] * TILE_SIZE, y - key[1] * TILE_SIZE)
+
+    def draw(self, painter, rect=None, target=QPoint(0, 0)):
+        """把与rect相交的图块绘制到painter上，target为文档原点所在位置"""
+        rect = self.rect() if rect is None else rect
+        for key in self.tiles_in(rect):
+            painter.drawImage(self.tile_rect(key).topLeft() + target, self._tiles[key])
+
+    def save(self, file_path, fmt=None, quality=-1):
+        return self.copy().save(file_path, fmt, quality)
+
+    # ── 写入 ──────────────────────────────────────────────────────
+    def write(self, image, pos=QPoint(0, 0)):
+        """把QImage按原样（含透明度）写入文档的pos位置，只触及相交的图块"""
+        area = QRect(pos, image.size())
+        for key in self.tiles_in(area):
+            tile_rect = self.tile_rect(key)
+            part = tile_rect.intersected(area)
+            painter = QPainter(self._tiles[key])
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(part.topLeft() - tile_rect.topLeft(), image,
+                              part.translated(-pos))
+            painter.end()
+        self.revision += 1
+
+    def fill(self, color):
+        for tile in self._tiles.values():
+            tile.fill(QColor(color))
+        self.revision += 1
+
+    def apply_to_tiles(self, func, progress=None):
+        """对每个图块就地执行func(tile)；progress(比例) 每完成一个图块调用一次"""
+        for index, tile in enumerate(self._tiles.values()):
+            func(tile)
+            if progress is not None:
+                progress((index + 1) / len(self._tiles))
+        self.revision += 1
+
+    def update_tiles(self, rect, func):
+        """对与rect相交的每个图块就地执行func(tile, tile_rect)，func返回True表示修改了该图块"""
+        changed = False
+        for key in self.tiles_in(rect):
+            if func(self._tiles[key], self.tile_rect(key)):
+                changed = True
+        if changed:
+            self.revision += 1
+
+    def begin_paint(self, rect):
+        """开始在文档的rect区域内绘制，返回使用文档坐标的QPainter
+
+        区域只落在一个图块内时直接在该图块上绘制；跨图块时在区域缓冲上绘制，
+        由 end_paint() 写回。rect 为 None 表示整幅文档。
+        """
+        rect = self.rect() if rect is None else QRect(rect).intersected(self.rect())
+        keys = self.tiles_in(rect)
+        if len(keys) == 1:
+            key = keys[0]
+            tile_rect = self.tile_rect(key)
+            painter = QPainter(self._tiles[key])
+            painter.translate(-tile_rect.x(), -tile_rect.y())
+            painter._tiled_target = (key, None, None)
+            self.revision += 1
+            return painter
+        if rect.isEmpty():
+            # 区域在文档之外：在一个无用的缓冲上绘制，不写回
+            buffer = QImage(1, 1, TILE_FORMAT)
+            painter = QPainter(buffer)
+            painter._tiled_target = (None, buffer, None)
+            return painter
+        buffer = self.copy(rect)
+        painter = QPainter(buffer)
+        painter.translate(-rect.x(), -rect.y())
+        painter._tiled_target = (None, buffer, rect)
+        return painter
+
+    def end_paint(self, painter):
+        """结束 begin_paint() 开始的绘制并写回文档"""
+        painter.end()
+        key, buffer, rect = painter._tiled_target
+        if rect is not None:
+            self.write(buffer, rect.topLeft())
+
+    def tile_digests(self, previous=None):
+        """各图块的内容摘要 {图块坐标: (cacheKey, CRC32)}
+
+        previous 是之前得到的摘要，其中cacheKey未变的图块（像素未被修改）直接沿用，
+        只对被修改过的图块重新计算。摘要只有几个整数，不引用图块的像素数据。
+        """
+        digests = {}
+        for key, tile in self._tiles.items():
+            cached = previous.get(key) if previous is not None else None
+            if cached is None or cached[0] != tile.cacheKey():
+                bits = tile.constBits()
+                bits.setsize(tile.byteCount())
+                cached = (tile.cacheKey(), zlib.crc32(bits))
+            digests[key] = cached
+        return digests
+
+    # ── 快照与尺寸变化 ────────────────────────────────────────────
+    def snapshot(self):
+        """返回当前状态的快照
+
+        每个图块只做浅拷贝（与当前图块共享像素数据），代价与图块数量成正比；
+        之后被修改的图块会自动分离，快照内容保持不变。
+        """
+        return (self._width, self._height, {key: QImage(tile) for key, tile in self._tiles.items()})
+
+    def restore(self, snapshot):
+        """恢复到快照状态，只替换引用发生变化的图块"""
+        width, height, tiles = snapshot
+        if (width, height) != (self._width, self._height):
+            self._width = width
+            self._height = height
+            self._cols = (width + TILE_SIZE - 1) // TILE_SIZE
+            self._rows = (height + TILE_SIZE - 1) // TILE_SIZE
+            self._tiles = {key: QImage(tile) for key, tile in tiles.items()}
+            self.revision += 1
+            return
+        for key, tile in tiles.items():
+            if self._tiles[key].cacheKey() != tile.cacheKey():
+                self._tiles[key] = QImage(tile)
+                self.revision += 1
+
+    def replace_tiles(self, width, height, tiles):
+        """把文档设为width×height，并用给定的完整图块替换图块网格"""
+        self._width = width
+        self._height = height
+        self._cols = (width + TILE_SIZE - 1) // TILE_SIZE
+        self._rows = (height + TILE_SIZE - 1) // TILE_SIZE
+        self._tiles = dict(tiles)
+        self.revision += 1
+
+    def assign(self, image):
+        """用一整张QImage替换文档内容，尺寸可以与当前不同"""
+        source = TiledImage.from_image(image)
+        self.replace_tiles(source._width, source._height, source._tiles)
+
+    def resized(self, width, height, fill_color=Qt.white):
+        """返回改变画布尺寸后的新图像：原内容保留在左上角，新增区域用fill_color填充"""
+        result = TiledImage.__new__(TiledImage)
+        result._width = max(int(width), 1)
+        result._height = max(int(height), 1)
+        result._cols = (result._width + TILE_SIZE - 1) // TILE_SIZE
+        result._rows = (result._height + TILE_SIZE - 1) // TILE_SIZE
+        result._tiles = {}
+        result.revision = 0
+        for key in result.tile_keys():
+            new_rect = result.tile_rect(key)
+            old = self._tiles.get(key)
+            if old is not None and self.tile_rect(key) == new_rect:
+                # 图块完整保留，直接共享像素数据
+                result._tiles[key] = QImage(old)
+            else:
+                tile = QImage(new_rect.width(), new_rect.height(), TILE_FORMAT)
+                tile.fill(QColor(fill_color))
+                if old is not None:
+                    painter = QPainter(tile)
+                    painter.setCompositionMode(QPainter.CompositionMode_Source)
+                    painter.drawImage(0, 0, old)
+                    painter.end()
+                result._tiles[key] = tile
+        return result
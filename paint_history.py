@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+撤销/重做历史
+每一步只保存被修改图块中发生变化的行（zlib压缩），总占用受字节预算限制；
+超出内存预算的步骤按最近最少使用顺序转存到临时文件，撤销到时再读回
+"""
+
+import bisect
+import tempfile
+import zlib
+from collections import OrderedDict
+
+from PyQt5.QtCore import QPoint
+from PyQt5.QtGui import QImage
+
+from paint_canvas_model import TILE_FORMAT
+
+# 默认历史记录内存预算（字节）
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024
+# 默认转存文件预算（字节），超出后丢弃最早的步骤
+DEFAULT_SPILL_BUDGET = 1024 * 1024 * 1024
+# zlib压缩级别（1最快，画布内容通常大片同色，压缩率已经足够）
+COMPRESS_LEVEL = 1
+
+
+def _tile_bytes(tile):
+    """图块像素数据的字节串"""
+    return tile.constBits().asstring(tile.byteCount())
+
+
+class TilePatch:
+    """一个图块中连续若干行的压缩像素"""
+
+    __slots__ = ("key", "y", "width", "rows", "data")
+
+    def __init__(self, key, y, width, rows, data):
+        self.key = key        # 图块坐标
+        self.y = y            # 起始行（图块内坐标）
+        self.width = width    # 图块宽度
+        self.rows = rows      # 行数
+        self.data = data      # zlib压缩后的像素
+
+    @classmethod
+    def capture(cls, key, tile, y=0, rows=None):
+        """压缩保存图块的第y行起rows行"""
+        rows = tile.height() - y if rows is None else rows
+        stride = tile.bytesPerLine()
+        raw = _tile_bytes(tile)[y * stride:(y + rows) * stride]
+        return cls(key, y, tile.width(), rows, zlib.compress(raw, COMPRESS_LEVEL))
+
+    def image(self):
+        """解压为QImage"""
+        raw = zlib.decompress(self.data)
+        return QImage(raw, self.width, self.rows, self.width * 4, TILE_FORMAT).copy()
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+class SpillFile:
+    """历史转存文件：压缩数据写入文件中的空闲区或末尾，索引记录每一步在文件中的位置
+
+    读回或丢弃的数据留下的空洞记入空闲表，之后的写入优先复用（首次适配），位于末尾的
+    空洞直接截掉；空洞总量超过仍被引用的数据量时整理文件，文件大小不超过数据量的两倍。
+    使用 tempfile.TemporaryFile，文件在 close() 或进程退出时删除。
+    """
+
+    def __init__(self):
+        self._file = None
+        self._end = 0  # 文件大小
+        self._free = []  # 空闲区 (偏移, 长度)，按偏移排序且互不相邻
+        self.index = {}  # 步骤序号 -> (偏移, 长度)
+        self.nbytes = 0  # 仍被引用的数据量
+
+    @property
+    def size(self):
+        """文件的实际大小（含空洞）"""
+        return self._end
+
+    def store(self, step, blob):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="paint_undo_", suffix=".spill")
+        length = len(blob)
+        for i, (offset, free) in enumerate(self._free):
+            if free >= length:
+                if free == length:
+                    del self._free[i]
+                else:
+                    self._free[i] = (offset + length, free - length)
+                break
+        else:
+            offset = self._end
+            self._end += length
+        self._file.seek(offset)
+        self._file.write(blob)
+        self.index[step] = (offset, length)
+        self.nbytes += length
+
+    def load(self, step):
+        """读回一步的数据并从索引中移除"""
+        offset, length = self.index.pop(step)
+        self._file.seek(offset)
+        blob = self._file.read(length)
+        self._release(offset, length)
+        return blob
+
+    def discard(self, step):
+        offset, length = self.index.pop(step)
+        self._release(offset, length)
+
+    def _release(self, offset, length):
+        """把一段数据所在的区域记为空闲，与相邻的空闲区合并"""
+        self.nbytes -= length
+        if not self.index:
+            # 已无引用的数据，从头复用文件
+            self._file.truncate(0)
+            self._end = 0
+            self._free = []
+            return
+        i = bisect.bisect(self._free, (offset, length))
+        if i < len(self._free) and offset + length == self._free[i][0]:
+            length += self._free.pop(i)[1]
+        if i > 0 and sum(self._free[i - 1]) == offset:
+            i -= 1
+            offset, length = self._free[i][0], self._free.pop(i)[1] + length
+        if offset + length == self._end:
+            # 末尾的空洞直接截掉
+            self._end = offset
+            self._file.truncate(offset)
+        else:
+            self._free.insert(i, (offset, length))
+        if self._end - self.nbytes > self.nbytes:
+            self.compact()
+
+    def compact(self):
+        """整理文件：把仍被引用的数据按原顺序移到文件开头，去掉所有空洞"""
+        position = 0
+        for step, (offset, length) in sorted(self.index.items(), key=lambda item: item[1][0]):
+            if offset != position:
+                self._file.seek(offset)
+                blob = self._file.read(length)
+                self._file.seek(position)
+                self._file.write(blob)
+                self.index[step] = (position, length)
+            position += length
+        if self._file is not None:
+            self._file.truncate(position)
+        self._end = position
+        self._free = []
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._end = 0
+        self._free = []
+        self.index.clear()
+        self.nbytes = 0
+
+
+class HistoryEntry:
+    """一步历史：文档尺寸和恢复该状态所需的图块补丁"""
+
+    _next_step = 0
+
+    def __init__(self, width, height, patches):
+        self.width = width
+        self.height = height
+        self.patches = patches
+        self.nbytes = sum(patch.nbytes for patch in patches)
+        self.step = HistoryEntry._next_step  # 转存文件索引使用的序号
+        HistoryEntry._next_step += 1
+        self.spilled = False
+
+    def spill(self, spill_file):
+        """把补丁数据写入转存文件，只在内存中保留补丁的位置信息"""
+        spill_file.store(self.step, b"".join(patch.data for patch in self.patches))
+        for patch in self.patches:
+            patch.data = len(patch.data)
+        self.spilled = True
+
+    def reload(self, spill_file):
+        """从转存文件读回补丁数据"""
+        blob = spill_file.load(self.step)
+        offset = 0
+        for patch in self.patches:
+            length = patch.data
+            patch.data = blob[offset:offset + length]
+            offset += length
+        self.spilled = False
+
+    def apply(self, image):
+        """把补丁写回分块图像"""
+        if (image.width(), image.height()) != (self.width, self.height):
+            # 尺寸变化的步骤保存的是完整图块，直接重建图块网格
+            image.replace_tiles(self.width, self.height,
+                                {patch.key: patch.image() for patch in self.patches})
+            return
+        for patch in self.patches:
+            origin = image.tile_rect(patch.key).topLeft()
+            image.write(patch.image(), origin + QPoint(0, patch.y))
+
+    def capture_inverse(self, image):
+        """在应用本步之前，从当前图像取出相同区域，用于反方向（重做/撤销）"""
+        if (image.width(), image.height()) != (self.width, self.height):
+            patches = [TilePatch.capture(key, image.tile(key)) for key in image.tile_keys()]
+        else:
+            patches = [TilePatch.capture(patch.key, image.tile(patch.key), patch.y, patch.rows)
+                       for patch in self.patches]
+        return HistoryEntry(image.width(), image.height(), patches)
+
+
+def diff_snapshot(snapshot, image):
+    """比较快照与当前图像，返回恢复快照所需的历史步骤；没有变化时返回None"""
+    width, height, tiles = snapshot
+    if (width, height) != (image.width(), image.height()):
+        patches = [TilePatch.capture(key, tile) for key, tile in tiles.items()]
+        return HistoryEntry(width, height, patches)
+
+    patches = []
+    for key, old in tiles.items():
+        new = image.tile(key)
+        if new.cacheKey() == old.cacheKey():
+            continue  # 图块仍与快照共享数据，未被修改
+        old_bytes = _tile_bytes(old)
+        new_bytes = _tile_bytes(new)
+        if old_bytes == new_bytes:
+            continue
+        # 只保存首个到最后一个变化行之间的行
+        stride = old.bytesPerLine()
+        top = 0
+        while old_bytes[top * stride:(top + 1) * stride] == new_bytes[top * stride:(top + 1) * stride]:
+            top += 1
+        bottom = old.height() - 1
+        while old_bytes[bottom * stride:(bottom + 1) * stride] == new_bytes[bottom * stride:(bottom + 1) * stride]:
+            bottom -= 1
+        patches.append(TilePatch.capture(key, old, top, bottom - top + 1))
+    if not patches:
+        return None
+    return HistoryEntry(width, height, patches)
+
+
+class UndoHistory:
+    """基于图块差异的撤销/重做历史
+
+    save_state() 之后文档发生的变化在下一次 save_state()/undo()/redo() 时
+    与上次记录的基准快照比较，只把变化部分压缩成一步历史。
+    内存中的步骤超过 budget_bytes 时，最近最少使用的步骤转存到临时文件；
+    转存文件超过 spill_budget_bytes 时丢弃最早的撤销步骤。
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_HISTORY_BUDGET, spill_budget_bytes=DEFAULT_SPILL_BUDGET):
+        self.budget_bytes = budget_bytes  # 内存中撤销+重做历史的总字节上限
+        self.spill_budget_bytes = spill_budget_bytes  # 转存文件的字节上限
+        self.undo_stack = []  # 撤销栈，存储HistoryEntry
+        self.redo_stack = []  # 重做栈
+        self._baseline = None  # 最近一次记录时的文档快照
+        self._resident = OrderedDict()  # 留在内存中的步骤，按使用先后排列（LRU）
+        self._spill = SpillFile()
+
+    @property
+    def nbytes(self):
+        """内存中历史数据的字节数"""
+        return sum(entry.nbytes for entry in self._resident.values())
+
+    @property
+    def spilled_bytes(self):
+        """转存文件中历史数据的字节数"""
+        return self._spill.nbytes
+
+    @property
+    def spill_file_bytes(self):
+        """转存文件的实际大小（含尚未复用的空洞）"""
+        return self._spill.size
+
+    def reset(self, image):
+        """清空历史并以当前图像作为新的基准"""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._resident.clear()
+        self._spill.close()
+        self._baseline = image.snapshot()
+
+    def close(self):
+        """释放历史并删除转存文件"""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._resident.clear()
+        self._spill.close()
+        self._baseline = None
+
+    def _push(self, stack, entry):
+        stack.append(entry)
+        self._resident[entry.step] = entry
+
+    def _pop(self, stack):
+        """弹出一步，已转存的步骤在这里读回内存"""
+        entry = stack.pop()
+        if entry.spilled:
+            entry.reload(self._spill)
+        else:
+            del self._resident[entry.step]
+        return entry
+
+    def _drop(self, entry):
+        if entry.spilled:
+            self._spill.discard(entry.step)
+        else:
+            del self._resident[entry.step]
+
+    def _record(self, image):
+        """把基准快照之后的变化记为一步历史，并以当前图像作为新的基准"""
+        if self._baseline is not None:
+            entry = diff_snapshot(self._baseline, image)
+            if entry is not None:
+                self._push(self.undo_stack, entry)
+                # 新操作会使重做历史失效
+                for stale in self.redo_stack:
+                    self._drop(stale)
+                self.redo_stack.clear()
+                self._enforce_budget()
+        self._baseline = image.snapshot()
+
+    def save_state(self, image):
+        """在操作执行前调用"""
+        self._record(image)
+
+    def undo(self, image):
+        self._record(image)
+        if not self.undo_stack:
+            return False
+        entry = self._pop(self.undo_stack)
+        self._push(self.redo_stack, entry.capture_inverse(image))
+        entry.apply(image)
+        self._baseline = image.snapshot()
+        self._enforce_budget()
+        return True
+
+    def redo(self, image):
+        self._record(image)
+        if not self.redo_stack:
+            return False
+        entry = self._pop(self.redo_stack)
+        self._push(self.undo_stack, entry.capture_inverse(image))
+        entry.apply(image)
+        self._baseline = image.snapshot()
+        self._enforce_budget()
+        return True
+
+    def _enforce_budget(self):
+        """内存超出预算时转存最近最少使用的步骤，转存文件超出预算时丢弃最早的撤销步骤"""
+        total = self.nbytes
+        while total > self.budget_bytes and len(self._resident) > 1:
+            _, entry = self._resident.popitem(last=False)
+            total -= entry.nbytes
+            entry.spill(self._spill)
+        while self._spill.nbytes > self.spill_budget_bytes and len(self.undo_stack) > 1:
+            self._drop(self.undo_stack.pop(0))
+        if self._spill.size > self.spill_budget_bytes:
+            # 数据量已在预算内，是空洞使文件超出预算：整理后文件大小等于数据量
+            self._spill.compact()
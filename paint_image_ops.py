@@ -0,0 +1,666 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+像素级图像运算
+通过NumPy直接访问QImage的像素内存，整块完成运算，避免逐像素调用Qt接口
+"""
+
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+import numpy as np
+
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRect
+from PyQt5.QtGui import QColor, QImage, QPainter, QPainterPath, QPen, QPolygon, QPolygonF, QTransform
+
+from paint_canvas_model import TILE_SIZE
+from paint_resample import resized_image
+
+# 扫描线填充结果逐段写入掩码的区间数上限，超过后改用整体累加
+MAX_SLICED_RUNS = 20000
+# 曲线细分时每小段折线的目标长度（像素）和每段样条的最大细分数
+CURVE_STEP = 4.0
+MAX_CURVE_STEPS = 256
+# 折线简化的默认容差（像素），小于一个像素，简化前后的选区掩码基本一致
+SIMPLIFY_TOLERANCE = 0.5
+# 运算使用的像素格式（非预乘ARGB32，小端内存中每个像素依次为B、G、R、A）
+PIXEL_FORMAT = QImage.Format_ARGB32
+# 顺时针旋转0、90、180、270度对应的无损方向置换
+RIGHT_ANGLES = (None, "rotate_90", "rotate_180", "rotate_270")
+# 只含直角旋转和翻转的变换矩阵(m11, m12, m21, m22) -> 方向置换，恒等变换为None；
+# "transpose" 沿主对角线翻转，"transverse" 沿副对角线翻转（翻转与直角旋转组合的结果）
+MATRIX_ORIENTATIONS = {
+    (1, 0, 0, 1): None,
+    (-1, 0, 0, 1): "horizontal",
+    (1, 0, 0, -1): "vertical",
+    (0, 1, -1, 0): "rotate_90",
+    (-1, 0, 0, -1): "rotate_180",
+    (0, -1, 1, 0): "rotate_270",
+    (0, 1, 1, 0): "transpose",
+    (0, -1, -1, 0): "transverse",
+}
+
+
+def image_view(image, writable=True):
+    """返回QImage像素的零拷贝视图，形状为(高, 宽, 4)，通道顺序B、G、R、A
+
+    image 必须是 PIXEL_FORMAT 格式；可写视图直接写入QImage的内存，
+    使用期间调用方需要保持 image 存活。只读视图不会使共享的QImage分离。
+    """
+    if writable:
+        bits = image.bits()
+        bits.setsize(image.byteCount())
+        buffer = bits
+    else:
+        buffer = image.constBits().asarray(image.byteCount())
+    rows = np.frombuffer(buffer, np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width() * 4].reshape(image.height(), image.width(), 4)
+
+
+def to_pixel_format(image):
+    """转换为运算使用的像素格式（已是该格式时原样返回）"""
+    if image.format() != PIXEL_FORMAT:
+        return image.convertToFormat(PIXEL_FORMAT)
+    return image
+
+
+def invert_image(image):
+    """就地反转QImage的RGB通道，保留透明度"""
+    pixels = image_view(image)[..., :3]
+    np.invert(pixels, out=pixels)
+
+
+def inverted_image(image):
+    """返回RGB通道反转后的图像副本，保留透明度"""
+    result = to_pixel_format(image).copy()
+    invert_image(result)
+    return result
+
+
+def _blank_like(image, width, height, background):
+    """与image同类（Alpha8掩码或ARGB32图像）的空白图像，用background填充"""
+    fmt = QImage.Format_Alpha8 if image.format() == QImage.Format_Alpha8 else PIXEL_FORMAT
+    result = QImage(width, height, fmt)
+    result.fill(background)
+    return result
+
+
+def _transformed_image(image, transform, background, progress=None):
+    """按QTransform变换图像，新图像大小为变换后的外接矩形，空出的部分用background填充
+
+    给出 progress 时按 TILE_SIZE 行一带分带绘制，progress(比例) 每画完一带调用一次。
+    """
+    bounds = transform.mapRect(image.rect())
+    result = _blank_like(image, bounds.width(), bounds.height(), background)
+    placement = transform * QTransform.fromTranslate(-bounds.x(), -bounds.y())
+    painter = QPainter(result)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    step = TILE_SIZE if progress is not None else max(bounds.height(), 1)
+    try:
+        for top in range(0, bounds.height(), step):
+            band = QRect(0, top, bounds.width(), min(step, bounds.height() - top))
+            # 裁剪区域在设置变换之前给出，按结果图像的像素行对齐，每个像素只画一次
+            painter.resetTransform()
+            painter.setClipRect(band)
+            painter.setTransform(placement)
+            painter.drawImage(0, 0, image)
+            if progress is not None:
+                progress(band.bottom() / max(bounds.height() - 1, 1))
+    finally:
+        painter.end()
+    return result
+
+
+def right_angle_orientation(angle):
+    """angle是90度的整数倍时返回对应的方向名称（0度为None），否则返回False"""
+    if angle % 90:
+        return False
+    return RIGHT_ANGLES[int(angle) // 90 % 4]
+
+
+def _pixel_rows(image, buffer):
+    """每个像素一个元素的(高, 宽)二维视图：32位图像为uint32，Alpha8为uint8"""
+    dtype = np.uint8 if image.format() == QImage.Format_Alpha8 else np.uint32
+    rows = np.frombuffer(buffer, np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows.view(dtype)[:, :image.width()]
+
+
+def _oriented_pixels(pixels, orientation):
+    """对(高, 宽)数组做方向置换，返回视图"""
+    if orientation == "horizontal":
+        return pixels[:, ::-1]
+    if orientation == "vertical":
+        return pixels[::-1]
+    if orientation == "rotate_90":
+        return np.rot90(pixels, -1)  # 屏幕坐标y轴向下，顺时针即NumPy的k=-1
+    if orientation == "rotate_180":
+        return pixels[::-1, ::-1]
+    if orientation == "transpose":
+        return pixels.T
+    if orientation == "transverse":
+        return pixels.T[::-1, ::-1]
+    return np.rot90(pixels, 1)
+
+
+def oriented_size(width, height, orientation):
+    """方向置换后的宽高"""
+    if orientation in ("rotate_90", "rotate_270", "transpose", "transverse"):
+        return height, width
+    return width, height
+
+
+def oriented_image(image, orientation):
+    """按orientation（"horizontal"、"vertical"、"rotate_90"、"rotate_180"、"rotate_270"、
+    "transpose"、"transverse"）重排像素，只搬运内存不做重采样；32位图像和Alpha8掩码保持原格式"""
+    if image.format() != QImage.Format_Alpha8 and image.depth() != 32:
+        image = to_pixel_format(image)
+    width, height = oriented_size(image.width(), image.height(), orientation)
+    result = QImage(width, height, image.format())
+    if width and height:
+        source = _oriented_pixels(
+            _pixel_rows(image, image.constBits().asarray(image.byteCount())), orientation)
+        target = _pixel_rows(result, result.bits().asarray(result.byteCount()))
+        # 按块搬运，旋转时读写也都停留在缓存内
+        for y in range(0, height, TILE_SIZE):
+            for x in range(0, width, TILE_SIZE):
+                target[y:y + TILE_SIZE, x:x + TILE_SIZE] = source[y:y + TILE_SIZE, x:x + TILE_SIZE]
+    return result
+
+
+def _oriented_source(orientation, rect, width, height):
+    """置换后图像中的rect对应原图（width×height）中的矩形"""
+    x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+    if orientation == "horizontal":
+        return QRect(width - x - w, y, w, h)
+    if orientation == "vertical":
+        return QRect(x, height - y - h, w, h)
+    if orientation == "rotate_90":
+        return QRect(y, height - x - w, h, w)
+    if orientation == "rotate_180":
+        return QRect(width - x - w, height - y - h, w, h)
+    if orientation == "transpose":
+        return QRect(y, x, h, w)
+    if orientation == "transverse":
+        return QRect(width - y - h, height - x - w, h, w)
+    return QRect(width - y - h, x, h, w)
+
+
+def orient_tiled(tiled, orientation, progress=None):
+    """就地对分块图像做方向置换：逐个生成新网格的图块，每个像素只搬运一次
+
+    progress(比例) 每完成一行图块调用一次，全部完成后才替换图块网格。
+    """
+    width, height = oriented_size(tiled.width(), tiled.height(), orientation)
+    tiles = {}
+    for ty in range(0, height, TILE_SIZE):
+        for tx in range(0, width, TILE_SIZE):
+            rect = QRect(tx, ty, min(TILE_SIZE, width - tx), min(TILE_SIZE, height - ty))
+            source = _oriented_source(orientation, rect, tiled.width(), tiled.height())
+            tiles[(tx // TILE_SIZE, ty // TILE_SIZE)] = oriented_image(tiled.copy(source), orientation)
+        if progress is not None:
+            progress(min(ty + TILE_SIZE, height) / height)
+    tiled.replace_tiles(width, height, tiles)
+
+
+def transform_orientation(transform):
+    """变换只含直角旋转和翻转（平移不计）时返回对应的方向置换，恒等变换返回None，否则返回False"""
+    if not transform.isAffine():
+        return False
+    matrix = tuple(round(value, 9) for value in
+                   (transform.m11(), transform.m12(), transform.m21(), transform.m22()))
+    return MATRIX_ORIENTATIONS.get(matrix, False)
+
+
+def transformed_image(image, transform, background=Qt.transparent, progress=None):
+    """按QTransform变换图像，直角旋转和翻转直接重排像素，其余变换重采样一次
+
+    只有缩放（可带翻转）的变换用 resized_image() 重采样，缩小不混叠、放大用双三次插值。
+    """
+    orientation = transform_orientation(transform)
+    if orientation is None:
+        return QImage(image)
+    if orientation:
+        return oriented_image(image, orientation)
+    if transform.isAffine() and round(transform.m12(), 9) == 0 and round(transform.m21(), 9) == 0:
+        size = transform.mapRect(image.rect()).size()
+        result = resized_image(image, size.width(), size.height(), progress)
+        if transform.m11() < 0:
+            result = oriented_image(result, "horizontal")
+        if transform.m22() < 0:
+            result = oriented_image(result, "vertical")
+        return result
+    return _transformed_image(image, transform, background, progress)
+
+
+def stretch_transform(horizontal_percent, vertical_percent):
+    """按百分比拉伸的变换"""
+    return QTransform.fromScale(horizontal_percent / 100, vertical_percent / 100)
+
+
+def skew_transform(horizontal_angle, vertical_angle):
+    """按水平、垂直角度（度）扭曲的变换"""
+    transform = QTransform()
+    transform.shear(horizontal_angle * 3.14159 / 180, vertical_angle * 3.14159 / 180)
+    return transform
+
+
+def flip_transform(direction):
+    """水平（"horizontal"）或垂直（"vertical"）翻转的变换"""
+    if direction == "horizontal":
+        return QTransform.fromScale(-1, 1)
+    return QTransform.fromScale(1, -1)
+
+
+def flipped_image(image, direction):
+    """水平（"horizontal"）或垂直（"vertical"）翻转图像，无损"""
+    return oriented_image(image, direction)
+
+
+def rotated_image(image, angle, background=Qt.transparent, progress=None):
+    """绕中心旋转angle度，90度的整数倍直接重排像素，其余角度重采样"""
+    return transformed_image(image, QTransform().rotate(angle), background, progress)
+
+
+def stretched_image(image, horizontal_percent, vertical_percent, progress=None):
+    """按百分比拉伸图像"""
+    width = int(image.width() * horizontal_percent / 100)
+    height = int(image.height() * vertical_percent / 100)
+    return resized_image(image, width, height, progress)
+
+
+def skewed_image(image, horizontal_angle, vertical_angle, background=Qt.transparent, progress=None):
+    """按水平、垂直角度（度）扭曲图像"""
+    return _transformed_image(image, skew_transform(horizontal_angle, vertical_angle), background, progress)
+
+
+def color_bgra(color):
+    """QColor转换为与 image_view() 通道顺序一致的(B, G, R, A)元组"""
+    return (color.blue(), color.green(), color.red(), color.alpha())
+
+
+def packed_color(color):
+    """QColor转换为与QImage(ARGB32)像素内存一致的uint32值"""
+    return np.uint32(color.rgba())
+
+
+def color_match_mask(pixels, bgra, tolerance=0):
+    """返回每个通道与bgra相差都不超过tolerance的像素掩码"""
+    if tolerance <= 0:
+        packed = pixels.view(np.uint32)[..., 0]
+        return packed == np.frombuffer(bytes(bgra), np.uint32)[0]
+    mask = np.ones(pixels.shape[:2], dtype=bool)
+    for channel, value in enumerate(bgra):
+        diff = np.abs(pixels[..., channel].astype(np.int16) - value)
+        mask &= diff <= tolerance
+    return mask
+
+
+def tiled_match_mask(tiled, bgra, tolerance=0):
+    """对分块图像逐块计算 color_match_mask()，拼成整幅文档的掩码"""
+    mask = np.empty((tiled.height(), tiled.width()), dtype=bool)
+    for key in tiled.tile_keys():
+        rect = tiled.tile_rect(key)
+        pixels = image_view(tiled.tile(key), writable=False)
+        mask[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = \
+            color_match_mask(pixels, bgra, tolerance)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def circle_mask(radius):
+    """半径为radius的圆形笔刷掩码，形状(2r+1, 2r+1)，按半径缓存"""
+    offsets = np.arange(-radius, radius + 1)
+    mask = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius * radius
+    mask.setflags(write=False)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def round_dot_mask(diameter):
+    """用宽diameter的圆头画笔画一个点时覆盖的像素，按直径缓存
+
+    直接用QPainter画出这个点再取覆盖的像素，与drawPoint的光栅化完全一致。
+    掩码是边长为奇数的方阵，点(x, y)对应掩码中心。
+    """
+    half = diameter // 2 + 2
+    image = QImage(2 * half + 1, 2 * half + 1, QImage.Format_Alpha8)
+    image.fill(0)
+    painter = QPainter(image)
+    painter.setPen(QPen(QColor(0, 0, 0), diameter, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+    painter.drawPoint(half, half)
+    painter.end()
+    mask = mask_view(image) != 0
+    mask.setflags(write=False)
+    return mask
+
+
+def disc_points(rng, cx, cy, radius, count):
+    """在以(cx, cy)为圆心、radius为半径的圆盘内均匀生成count个整数坐标点，返回(xs, ys)"""
+    distance = radius * np.sqrt(rng.random(count))
+    angle = rng.random(count) * (2 * np.pi)
+    xs = np.trunc(cx + distance * np.cos(angle)).astype(int)
+    ys = np.trunc(cy + distance * np.sin(angle)).astype(int)
+    return xs, ys
+
+
+def tiled_pixels_at(tiled, xs, ys):
+    """分块图像在整数坐标(xs, ys)处的像素值（uint32数组），坐标必须在图像内，直接从图块读取"""
+    values = np.empty(len(xs), dtype=np.uint32)
+    tiles = (ys // TILE_SIZE) * (tiled.width() // TILE_SIZE + 1) + xs // TILE_SIZE
+    for index in np.unique(tiles):
+        inside = tiles == index
+        key = (int(xs[inside][0]) // TILE_SIZE, int(ys[inside][0]) // TILE_SIZE)
+        rect = tiled.tile_rect(key)
+        pixels = image_view(tiled.tile(key), writable=False).view(np.uint32)[..., 0]
+        values[inside] = pixels[ys[inside] - rect.y(), xs[inside] - rect.x()]
+    return values
+
+
+def erase_dots(tiled, xs, ys, diameter, background):
+    """橡皮擦：在(xs, ys)中颜色不是background的采样点上盖直径为diameter的background圆点
+
+    采样点的颜色直接从图块读取，所有圆点合成一个掩码后只写入被覆盖的图块。
+    返回被修改区域的矩形，没有需要擦除的点时返回空矩形。
+    """
+    keep = tiled_pixels_at(tiled, xs, ys) != packed_color(background)
+    xs, ys = xs[keep], ys[keep]
+    if len(xs) == 0:
+        return QRect()
+    dot = round_dot_mask(diameter)
+    size = dot.shape[0]
+    left, top = int(xs.min()), int(ys.min())
+    rect = QRect(left - size // 2, top - size // 2,
+                 int(xs.max()) - left + size, int(ys.max()) - top + size)
+    mask = np.zeros((rect.height(), rect.width()), dtype=bool)
+    for x, y in zip((xs - left).tolist(), (ys - top).tolist()):
+        mask[y:y + size, x:x + size] |= dot
+    fill_tiled_mask(tiled, rect, mask, background)
+    return rect
+
+
+def replace_color_masked(tiled, rect, mask, old_color, new_color):
+    """把rect内mask为True且颜色等于old_color的像素改为new_color
+
+    mask 的形状与rect大小一致。先用只读视图判断，只有确实需要修改的图块才会被写入。
+    """
+    old_value = packed_color(old_color)
+    new_value = packed_color(new_color)
+
+    def replace_tile(tile, tile_rect):
+        part = tile_rect.intersected(rect)
+        ys = slice(part.top() - tile_rect.top(), part.bottom() + 1 - tile_rect.top())
+        xs = slice(part.left() - tile_rect.left(), part.right() + 1 - tile_rect.left())
+        brush = mask[part.top() - rect.top():part.bottom() + 1 - rect.top(),
+                     part.left() - rect.left():part.right() + 1 - rect.left()]
+        pixels = image_view(tile, writable=False).view(np.uint32)[ys, xs, 0]
+        hits = (pixels == old_value) & brush
+        if not hits.any():
+            return False
+        image_view(tile).view(np.uint32)[ys, xs, 0][hits] = new_value
+        return True
+
+    tiled.update_tiles(rect, replace_tile)
+
+
+def polygon_mask(points, width, height):
+    """把多边形（QPoint列表）光栅化为 width×height 的Alpha8选区掩码
+
+    内部为255、外部为0，边缘按覆盖比例抗锯齿。
+    """
+    mask = QImage(width, height, QImage.Format_Alpha8)
+    mask.fill(Qt.transparent)
+    painter = QPainter(mask)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(Qt.black)
+    painter.drawPolygon(QPolygon(points))
+    painter.end()
+    return mask
+
+
+def mask_view(mask):
+    """Alpha8掩码图像的只读零拷贝视图，形状为(高, 宽)"""
+    buffer = mask.constBits().asarray(mask.byteCount())
+    rows = np.frombuffer(buffer, np.uint8).reshape(mask.height(), mask.bytesPerLine())
+    return rows[:, :mask.width()]
+
+
+def apply_alpha_mask(image, mask):
+    """用掩码裁剪图像：就地把掩码外的像素设为透明（image需为预乘或非预乘ARGB32）"""
+    painter = QPainter(image)
+    painter.setCompositionMode(QPainter.CompositionMode_DestinationIn)
+    painter.drawImage(0, 0, mask)
+    painter.end()
+
+
+def polygon_cropped(tiled, points, background):
+    """裁剪到多边形：返回points外接矩形大小的图像，多边形外部用background填充"""
+    left = min(p.x() for p in points)
+    top = min(p.y() for p in points)
+    width = max(p.x() for p in points) - left
+    height = max(p.y() for p in points) - top
+    # 只读取边界矩形内的图块，用多边形掩码去掉外部
+    image = tiled.copy(QRect(left, top, width, height))
+    apply_alpha_mask(image, polygon_mask([QPoint(p.x() - left, p.y() - top) for p in points], width, height))
+    result = QImage(width, height, QImage.Format_ARGB32)
+    result.fill(background)
+    painter = QPainter(result)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return result
+
+
+def fill_tiled_mask(tiled, rect, mask, color):
+    """把rect内mask非零的像素设为color，mask为与rect大小一致的数组，只写入有像素被选中的图块"""
+    value = packed_color(color)
+
+    def fill_tile(tile, tile_rect):
+        part = tile_rect.intersected(rect)
+        selected = mask[part.top() - rect.top():part.bottom() + 1 - rect.top(),
+                        part.left() - rect.left():part.right() + 1 - rect.left()] != 0
+        if not selected.any():
+            return False
+        ys = slice(part.top() - tile_rect.top(), part.bottom() + 1 - tile_rect.top())
+        xs = slice(part.left() - tile_rect.left(), part.right() + 1 - tile_rect.left())
+        image_view(tile).view(np.uint32)[ys, xs, 0][selected] = value
+        return True
+
+    tiled.update_tiles(rect, fill_tile)
+
+
+def mask_bounds(mask):
+    """返回掩码中True像素的外接范围(左, 上, 右, 下)，没有True时返回None"""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1]))
+
+
+def fill_tiled_region(tiled, region, rect, color):
+    """把分块图像中region为True的像素设为color，只触及与rect相交且包含这些像素的图块"""
+    value = packed_color(color)
+
+    def fill_tile(tile, tile_rect):
+        part = region[tile_rect.top():tile_rect.bottom() + 1, tile_rect.left():tile_rect.right() + 1]
+        if part.any():
+            image_view(tile).view(np.uint32)[..., 0][part] = value
+            return True
+        return False
+
+    tiled.update_tiles(rect, fill_tile)
+
+
+def flood_fill_region(match, x, y, connectivity=4):
+    """扫描线填充：从(x, y)出发，在match为True的像素中找出连通区域
+
+    先用NumPy把每一行拆成连续区间（行程），再以区间为单位做广度搜索：
+    一个区间与上下两行中重叠（8连通时含对角相接）的区间连通。
+    connectivity 为4或8。返回(区域掩码, (左, 上, 右, 下))，起点不可填充时返回(None, None)。
+    """
+    height, width = match.shape
+    if not match[y, x]:
+        return None, None
+    # 每行的区间 [start, end)：行内相邻像素取值变化处依次是区间的起点和终点
+    padded = np.zeros((height, width + 2), dtype=bool)
+    padded[:, 1:-1] = match
+    edges = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    run_rows = edges[0::2] // (width + 1)
+    run_starts = edges[0::2] % (width + 1)
+    run_ends = edges[1::2] % (width + 1)
+    row_first = np.searchsorted(run_rows, np.arange(height + 1)).tolist()
+    starts = run_starts.tolist()
+    ends = run_ends.tolist()
+
+    reach = 1 if connectivity == 8 else 0
+    seed = bisect_right(starts, x, row_first[y], row_first[y + 1]) - 1
+    visited = bytearray(len(starts))
+    visited[seed] = 1
+    filled = [seed]
+    stack = [(seed, y)]
+    while stack:
+        run, row = stack.pop()
+        low = starts[run] - reach
+        high = ends[run] + reach
+        for next_row in (row - 1, row + 1):
+            if not 0 <= next_row < height:
+                continue
+            first = row_first[next_row]
+            # 该行中起点小于high的区间里，终点大于low的与当前区间相接
+            j = bisect_left(starts, high, first, row_first[next_row + 1]) - 1
+            while j >= first and ends[j] > low:
+                if not visited[j]:
+                    visited[j] = 1
+                    filled.append(j)
+                    stack.append((j, next_row))
+                j -= 1
+
+    # 由选中的区间生成掩码：区间不多时逐段赋值，否则在起点处+1、终点处-1后逐行累加
+    filled = np.array(filled)
+    rows = run_rows[filled]
+    left = run_starts[filled]
+    right = run_ends[filled]
+    if len(filled) <= MAX_SLICED_RUNS:
+        region = np.zeros((height, width), dtype=bool)
+        for row, start, end in zip(rows.tolist(), left.tolist(), right.tolist()):
+            region[row, start:end] = True
+    else:
+        steps = np.zeros(height * (width + 1), dtype=np.int8)
+        steps[rows * (width + 1) + left] = 1
+        steps[rows * (width + 1) + right] = -1
+        region = np.cumsum(steps, dtype=np.int8).reshape(height, width + 1)[:, :width].astype(bool)
+    bounds = (int(left.min()), int(rows.min()), int(right.max()) - 1, int(rows.max()))
+    return region, bounds
+
+
+def flood_fill_tiled(tiled, x, y, color, tolerance=0, mode="flood", connectivity=4, progress=None):
+    """填充工具的完整运算：把与(x, y)处颜色相近的连通区域填为color，mode为"replace"时替换整幅图中的该颜色
+
+    返回被填充像素的外接矩形，没有可填充的像素时返回None。progress(比例) 在各阶段之间调用。
+    """
+    # 填充范围未知，先计算整幅文档的颜色匹配掩码
+    match = tiled_match_mask(tiled, color_bgra(tiled.pixelColor(x, y)), tolerance)
+    if progress is not None:
+        progress(0.5)
+    if mode == "replace":
+        # 替换模式：所有匹配的像素都被替换，不要求连通
+        region, bounds = match, mask_bounds(match)
+    else:
+        # 填充模式：在掩码上做扫描线填充
+        region, bounds = flood_fill_region(match, x, y, connectivity)
+    if region is None or bounds is None:
+        return None
+    if progress is not None:
+        progress(0.75)
+    left, top, right, bottom = bounds
+    rect = QRect(QPoint(left, top), QPoint(right, bottom))
+    # 只修改被填充像素所在的图块
+    fill_tiled_region(tiled, region, rect, color)
+    if progress is not None:
+        progress(1.0)
+    return rect
+
+
+def filled_image(image, x, y, color, tolerance=0, mode="flood", connectivity=4, selected=None):
+    """在单张图像上执行填充工具的运算，返回填充后的副本，没有可填充的像素时返回None
+
+    selected 为与图像同尺寸的布尔数组时，只有其中为True的像素可以被填充（任意形状选区的掩码）。
+    """
+    result = to_pixel_format(image).copy()
+    pixels = image_view(result)
+    match = color_match_mask(pixels, color_bgra(result.pixelColor(x, y)), tolerance)
+    if selected is not None:
+        match &= selected
+    if mode == "replace":
+        region = match if match.any() else None
+    else:
+        region = flood_fill_region(match, x, y, connectivity)[0]
+    if region is None:
+        return None
+    pixels.view(np.uint32)[..., 0][region] = packed_color(color)
+    return result
+
+
+def catmull_rom_polyline(p0, p1, p2, p3, step=CURVE_STEP):
+    """对多段Catmull-Rom样条一次性求值
+
+    p0..p3 为形状(段数, 2)的控制点数组，第i段从p1[i]到p2[i]。
+    每段的细分数由其等价贝塞尔控制多边形的长度决定，越长、越弯的段点越多。
+    返回形状(点数, 2)的浮点数组，各段首尾相接成一条折线。
+    """
+    b1 = p1 + (p2 - p0) / 6
+    b2 = p2 - (p3 - p1) / 6
+    length = (np.hypot(*(b1 - p1).T) + np.hypot(*(b2 - b1).T) + np.hypot(*(p2 - b2).T))
+    counts = np.clip(np.ceil(length / step), 1, MAX_CURVE_STEPS).astype(int)
+    segment = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    t = ((np.arange(counts.sum()) - offsets[segment]) / counts[segment])[:, None]
+    a, b, c, d = p0[segment], p1[segment], p2[segment], p3[segment]
+    points = 0.5 * (2 * b + (c - a) * t + (2 * a - 5 * b + 4 * c - d) * t ** 2
+                    + (3 * b - a - 3 * c + d) * t ** 3)
+    return np.vstack([points, p2[-1:]])
+
+
+def catmull_rom_curve(points, step=CURVE_STEP):
+    """经过全部控制点（QPoint列表）的Catmull-Rom样条折线，首尾用端点自身作虚拟控制点"""
+    controls = np.array([(p.x(), p.y()) for p in points], dtype=float)
+    if len(controls) < 3:
+        return controls
+    padded = np.vstack([controls[:1], controls, controls[-1:]])
+    return catmull_rom_polyline(padded[:-3], padded[1:-2], padded[2:-1], padded[3:], step)
+
+
+def polyline_path(points):
+    """把形状(点数, 2)的数组转换为QPainterPath折线"""
+    path = QPainterPath()
+    path.addPolygon(QPolygonF([QPointF(x, y) for x, y in points.tolist()]))
+    return path
+
+
+def simplify_polyline(points, tolerance=SIMPLIFY_TOLERANCE):
+    """Ramer-Douglas-Peucker折线简化，返回要保留的顶点掩码（首尾总是保留）
+
+    points 为形状(点数, 2)的数组；被去掉的顶点到简化后折线的距离都不超过tolerance。
+    """
+    points = np.asarray(points, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        chord = points[last] - points[first]
+        offsets = points[first + 1:last] - points[first]
+        length = np.hypot(*chord)
+        if length == 0:
+            distance = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distance = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        index = int(np.argmax(distance))
+        if distance[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
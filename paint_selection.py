@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选区掩码
+用文档坐标中的外接矩形加同尺寸的字节掩码表示任意形状的选区，
+并集、差集、交集、反选、扩展和收缩都是整块的NumPy运算
+"""
+
+import numpy as np
+
+from PyQt5.QtCore import QPoint, QRect
+from PyQt5.QtGui import QImage
+
+from paint_image_ops import polygon_mask, mask_view, mask_bounds, circle_mask, image_view
+
+# 掩码中完全选中的值；抗锯齿边缘的像素取 1~254 之间的覆盖率
+SELECTED = 255
+# 选区边框虚线的颜色（ARGB）和每段长度（像素）
+OUTLINE_COLOR = 0xFF0000FF
+OUTLINE_DASH = 4
+
+
+class SelectionMask:
+    """任意形状选区
+
+    rect 是选区外接矩形（文档坐标），bits 是形状为(高, 宽)的uint8覆盖率掩码，
+    0 表示未选中，SELECTED 表示完全选中。所有运算都返回新的掩码，不修改自身。
+    """
+
+    __slots__ = ("rect", "bits", "_alpha", "_outline")
+
+    def __init__(self, rect, bits):
+        self.rect = QRect(rect)
+        self.bits = bits
+        self._alpha = None  # 缓存的Alpha8图像
+        self._outline = None  # 缓存的边框图像
+
+    # ── 创建 ──────────────────────────────────────────────────────
+    @classmethod
+    def empty(cls):
+        return cls(QRect(), np.zeros((0, 0), dtype=np.uint8))
+
+    @classmethod
+    def from_rect(cls, rect):
+        """完全选中的矩形选区"""
+        rect = QRect(rect).normalized()
+        return cls(rect, np.full((rect.height(), rect.width()), SELECTED, dtype=np.uint8))
+
+    @classmethod
+    def from_polygon(cls, points, rect=None):
+        """由多边形顶点（文档坐标的QPoint列表）光栅化，rect 默认为顶点的外接矩形"""
+        if rect is None:
+            xs = [p.x() for p in points]
+            ys = [p.y() for p in points]
+            rect = QRect(min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+        if rect.isEmpty():
+            return cls.empty()
+        local = [p - rect.topLeft() for p in points]
+        return cls.from_alpha(polygon_mask(local, rect.width(), rect.height()), rect.topLeft())
+
+    @classmethod
+    def from_alpha(cls, image, origin=QPoint(0, 0)):
+        """由Alpha8图像（或带透明通道的图像的透明度）创建，origin 为图像左上角的文档坐标"""
+        if image.format() != QImage.Format_Alpha8:
+            image = image.convertToFormat(QImage.Format_Alpha8)
+        return cls(QRect(origin, image.size()), mask_view(image).copy())
+
+    @classmethod
+    def from_bool(cls, selected, origin=QPoint(0, 0)):
+        """由布尔数组创建，origin 为数组左上角的文档坐标"""
+        height, width = selected.shape
+        bits = selected.view(np.uint8) * np.uint8(SELECTED)
+        return cls(QRect(origin.x(), origin.y(), width, height), bits)
+
+    # ── 查询 ──────────────────────────────────────────────────────
+    def isEmpty(self):
+        return self.rect.isEmpty() or not self.bits.any()
+
+    def contains(self, pos):
+        """文档坐标的点是否在选区内，与选区形状的复杂度无关"""
+        x = pos.x() - self.rect.x()
+        y = pos.y() - self.rect.y()
+        return 0 <= y < self.bits.shape[0] and 0 <= x < self.bits.shape[1] and bool(self.bits[y, x])
+
+    def selected(self):
+        """选中像素（覆盖率过半）的布尔数组"""
+        return self.bits >= SELECTED // 2 + 1
+
+    def bounds(self):
+        """选中像素的紧凑外接矩形（文档坐标），没有选中像素时返回空矩形"""
+        box = mask_bounds(self.bits != 0)
+        if box is None:
+            return QRect()
+        left, top, right, bottom = box
+        return QRect(self.rect.x() + left, self.rect.y() + top, right - left + 1, bottom - top + 1)
+
+    def alpha_image(self):
+        """选区的Alpha8图像（与 rect 同尺寸），可直接用于QPainter合成"""
+        if self._alpha is None:
+            height, width = self.bits.shape
+            image = QImage(width, height, QImage.Format_Alpha8)
+            if width and height:
+                view = np.frombuffer(image.bits().asarray(image.byteCount()), np.uint8)
+                view.reshape(height, image.bytesPerLine())[:, :width] = self.bits
+            self._alpha = image
+        return self._alpha
+
+    def outline_image(self):
+        """选区边框的ARGB32图像（与 rect 同尺寸）：边界像素按蓝色虚线着色，其余透明
+
+        直接由掩码逐像素生成，代价与选区面积成正比，形状再复杂也只需一次drawImage。
+        """
+        if self._outline is None:
+            height, width = self.bits.shape
+            image = QImage(width, height, QImage.Format_ARGB32)
+            image.fill(0)
+            if width and height:
+                selected = self.selected()
+                # 四邻域都选中的是内部像素，外接矩形之外视为未选中
+                interior = selected.copy()
+                interior[1:] &= selected[:-1]
+                interior[:-1] &= selected[1:]
+                interior[:, 1:] &= selected[:, :-1]
+                interior[:, :-1] &= selected[:, 1:]
+                interior[[0, -1]] = False
+                interior[:, [0, -1]] = False
+                ys, xs = np.ogrid[:height, :width]
+                dashes = ((xs + ys) // OUTLINE_DASH) % 2 == 0
+                image_view(image).view(np.uint32)[..., 0][selected & ~interior & dashes] = OUTLINE_COLOR
+            self._outline = image
+        return self._outline
+
+    # ── 变换 ──────────────────────────────────────────────────────
+    def translated(self, offset):
+        return SelectionMask(self.rect.translated(offset), self.bits)
+
+    def cropped(self):
+        """去掉四周空白后的选区"""
+        bounds = self.bounds()
+        if bounds.isEmpty():
+            return SelectionMask.empty()
+        return SelectionMask(bounds, self._slice(bounds))
+
+    def mapped(self, operation):
+        """把图像运算 operation(QImage) -> QImage 作用到掩码上，返回左上角不变的新选区"""
+        result = operation(self.alpha_image())
+        return SelectionMask.from_alpha(result, self.rect.topLeft())
+
+    # ── 布尔运算 ──────────────────────────────────────────────────
+    def _slice(self, rect):
+        """返回rect（必须在 self.rect 内）对应的掩码切片"""
+        top = rect.y() - self.rect.y()
+        left = rect.x() - self.rect.x()
+        return self.bits[top:top + rect.height(), left:left + rect.width()]
+
+    def _placed(self, rect):
+        """把掩码放到更大的rect中，rect外部为未选中"""
+        bits = np.zeros((rect.height(), rect.width()), dtype=np.uint8)
+        part = self.rect.intersected(rect)
+        if not part.isEmpty():
+            bits[part.y() - rect.y():part.y() - rect.y() + part.height(),
+                 part.x() - rect.x():part.x() - rect.x() + part.width()] = self._slice(part)
+        return bits
+
+    def united(self, other):
+        """并集"""
+        if other.rect.isEmpty():
+            return self
+        if self.rect.isEmpty():
+            return other
+        rect = self.rect.united(other.rect)
+        return SelectionMask(rect, np.maximum(self._placed(rect), other._placed(rect)))
+
+    def intersected(self, other):
+        """交集"""
+        rect = self.rect.intersected(other.rect)
+        if rect.isEmpty():
+            return SelectionMask.empty()
+        return SelectionMask(rect, np.minimum(self._slice(rect), other._slice(rect)))
+
+    def subtracted(self, other):
+        """差集：从本选区中去掉other"""
+        if self.rect.isEmpty():
+            return self
+        bits = np.minimum(self.bits, SELECTED - other._placed(self.rect))
+        return SelectionMask(self.rect, bits)
+
+    def inverted(self, rect):
+        """反选：rect（通常是整幅画布）中不在本选区内的部分"""
+        return SelectionMask(QRect(rect), SELECTED - self._placed(QRect(rect)))
+
+    def grown(self, radius):
+        """向外扩展radius像素（圆形结构元素），结果是不带抗锯齿的硬边选区"""
+        if radius <= 0 or self.rect.isEmpty():
+            return self
+        rect = self.rect.adjusted(-radius, -radius, radius, radius)
+        return SelectionMask.from_bool(_dilate(self.selected(), radius), rect.topLeft())
+
+    def shrunk(self, radius):
+        """向内收缩radius像素：对未选中部分扩展后取反，选区外都视为未选中"""
+        if radius <= 0 or self.rect.isEmpty():
+            return self
+        outside = _dilate(~self.selected(), radius)[radius:-radius, radius:-radius]
+        # 外接矩形的边界之外也是未选中，边缘的radius像素一并去掉
+        outside[:radius] = outside[-radius:] = True
+        outside[:, :radius] = outside[:, -radius:] = True
+        return SelectionMask.from_bool(~outside, self.rect.topLeft())
+
+
+def _dilate(selected, radius):
+    """用半径为radius的圆盘膨胀布尔数组，返回四周各扩大radius的数组
+
+    圆盘每一行是一段水平区间：先用前缀和求出每个像素所在水平窗口内是否有选中像素，
+    再按行偏移合并，代价与半径成正比而不是与圆盘面积成正比。
+    """
+    height, width = selected.shape
+    disc = circle_mask(radius)
+    padded = np.zeros((height + 2 * radius, width + 4 * radius + 1), dtype=np.int32)
+    padded[radius:radius + height, 2 * radius + 1:2 * radius + 1 + width] = selected
+    prefix = np.cumsum(padded, axis=1)
+    result = np.zeros((height + 2 * radius, width + 2 * radius), dtype=bool)
+    columns = np.arange(width + 2 * radius) + radius + 1
+    for dy in range(-radius, radius + 1):
+        half = int(disc[dy + radius].sum()) // 2
+        # 窗口 [x - half, x + half] 内的选中像素数
+        window = prefix[:, columns + half] - prefix[:, columns - half - 1]
+        rows = window > 0
+        if dy < 0:
+            result[-dy:] |= rows[:dy]
+        elif dy > 0:
+            result[:-dy] |= rows[dy:]
+        else:
+            result |= rows
+    return result